@@ -0,0 +1,123 @@
+# debug/bench_flatten.py
+# Benchmark: utils.flatten.flatten vs the recursive flatteners it replaced
+# (mongodb_to_sql.flatten, namespace_mapper.flatten_json,
+# parsers.structured_parser.flatten_dict), on wide and deep payloads.
+# Checks that the outputs are identical before timing.
+#
+# Usage: python debug/bench_flatten.py [--repeat 5]
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import gc
+import statistics
+import time
+from collections.abc import MutableMapping
+
+from utils.flatten import flatten
+
+
+# --- Previous implementations (reference) ---
+def old_mongodb_to_sql(d, prefix="", out=None):
+    if out is None:
+        out = {}
+    if isinstance(d, dict):
+        for k, v in d.items():
+            old_mongodb_to_sql(v, f"{prefix}{k}." if prefix else f"{k}.", out)
+    elif isinstance(d, list):
+        for i, v in enumerate(d):
+            old_mongodb_to_sql(v, f"{prefix}{i}.", out)
+    else:
+        out[prefix[:-1]] = d
+    return out
+
+
+def old_flatten_json(obj, parent_key="", sep="."):
+    items = {}
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            new_key = f"{parent_key}{sep}{k}" if parent_key else k
+            items.update(old_flatten_json(v, new_key, sep))
+    elif isinstance(obj, list):
+        for i, v in enumerate(obj):
+            new_key = f"{parent_key}{sep}{i}"
+            items.update(old_flatten_json(v, new_key, sep))
+    else:
+        items[parent_key] = obj
+    return items
+
+
+def old_flatten_dict(d, parent_key='', sep='.'):
+    items = []
+    for k, v in d.items():
+        new_key = f"{parent_key}{sep}{k}" if parent_key else k
+        if isinstance(v, MutableMapping):
+            items.extend(old_flatten_dict(v, new_key, sep=sep).items())
+        else:
+            items.append((new_key, v))
+    return dict(items)
+
+
+# --- Payloads ---
+def wide(n_nodes=500):
+    """A typical metrics body: many keys, two or three levels."""
+    return {
+        f"node_{i}": {
+            "cpu": {"user": i * 0.5, "system": i * 0.1},
+            "mem": i * 1024,
+            "disks": [{"read": i, "write": i + 1}, {"read": i + 2, "write": i + 3}],
+        }
+        for i in range(n_nodes)
+    }
+
+
+def deep(depth=200, fanout=3):
+    """A chain of nested levels, each with a few leaves."""
+    doc = {"leaf": 0}
+    for level in range(depth):
+        doc = {f"l{level}": doc, **{f"v{j}": level * j for j in range(fanout)}}
+    return doc
+
+
+def bench(fn, payload, repeat):
+    fn(payload)  # warm-up
+    gc.collect()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(payload)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def main(repeat: int) -> None:
+    payloads = {"wide (5000 keys)": wide(), "deep (200 levels)": deep(), "deep (800 levels)": deep(800),
+                "deep (2000 levels)": deep(2000)}
+    cases = [
+        ("mongodb_to_sql.flatten", old_mongodb_to_sql, lambda p: flatten(p)),
+        ("flatten_json", old_flatten_json, lambda p: flatten(p)),
+        ("flatten_dict", old_flatten_dict, lambda p: flatten(p, lists=False)),
+    ]
+    print(f"{'payload':>18} {'replaces':>23} {'old ms':>9} {'new ms':>9} {'speedup':>8}")
+    for name, payload in payloads.items():
+        for label, old, new in cases:
+            try:
+                expected = old(payload)
+            except RecursionError:
+                expected = None
+            got = new(payload)
+            if expected is not None and (got != expected or list(got) != list(expected)):
+                raise SystemExit(f"{label} differs on {name}")
+            new_ms = bench(new, payload, repeat)
+            if expected is None:
+                print(f"{name:>18} {label:>23} {'RecursionError':>14} {new_ms:>9.2f}")
+                continue
+            old_ms = bench(old, payload, repeat)
+            print(f"{name:>18} {label:>23} {old_ms:>9.2f} {new_ms:>9.2f} {old_ms / new_ms:>7.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the shared flattener against the old ones.")
+    parser.add_argument("--repeat", type=int, default=5)
+    main(parser.parse_args().repeat)
@@ -0,0 +1,86 @@
+# debug/bench_mapping_index.py
+# Benchmark: namespace_mapper_core.extract_metrics with the source -> unified
+# index (project_config.metric_mapping.registry) vs the previous scan over
+# every unified key's source list, on a large generated registry.
+# Checks that both give the same result before timing.
+#
+# Usage: python debug/bench_mapping_index.py [--unified 5000] [--sources 8] [--raw 2000]
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import json
+import random
+import tempfile
+import time
+
+import namespace_mapper_core
+from project_config.metric_mapping import MappingRegistry
+
+
+def old_extract_metrics(raw_metrics: dict, unified_metric_mapping: dict) -> dict:
+    mapped = {}
+    for raw_key, value in raw_metrics.items():
+        for unified_key, config in unified_metric_mapping.items():
+            if raw_key in config.get("sources", []):
+                mapped[unified_key] = value
+                break
+    return mapped
+
+
+def make_registry(n_unified: int, n_sources: int) -> dict:
+    return {
+        f"std.category_{u % 40}.metric_{u}": {
+            "tags": ["bench"],
+            "sources": [f"dc{s}.node.metric_{u}" for s in range(n_sources)],
+        }
+        for u in range(n_unified)
+    }
+
+
+def main(n_unified: int, n_sources: int, n_raw: int) -> None:
+    rnd = random.Random(22)
+    mapping = make_registry(n_unified, n_sources)
+    # Two thirds of the raw keys are known sources, the rest unmapped
+    raw = {}
+    for i in range(n_raw):
+        if i % 3:
+            raw[f"dc{rnd.randrange(n_sources)}.node.metric_{rnd.randrange(n_unified)}"] = float(i)
+        else:
+            raw[f"unknown.metric_{i}"] = float(i)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "metric_mapping.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(mapping, f)
+        namespace_mapper_core.registry = MappingRegistry(path, first_wins=True)
+
+        start = time.perf_counter()
+        namespace_mapper_core.registry.refresh()
+        build_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        new = namespace_mapper_core.extract_metrics(raw, "bench")
+        new_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        old = old_extract_metrics(raw, mapping)
+        old_ms = (time.perf_counter() - start) * 1000
+
+    if new != old:
+        raise SystemExit("extract_metrics results differ")
+    print(f"{n_unified} unified keys x {n_sources} sources = {n_unified * n_sources} sources; "
+          f"{n_raw} raw keys, {len(new)} mapped")
+    print(f"  index build (load + invert, once per file version): {build_ms:9.1f} ms")
+    print(f"  extract_metrics, index:                             {new_ms:9.1f} ms")
+    print(f"  extract_metrics, scan (previous):                   {old_ms:9.1f} ms  ({old_ms / new_ms:.0f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark extract_metrics with and without the source index.")
+    parser.add_argument("--unified", type=int, default=5000)
+    parser.add_argument("--sources", type=int, default=8, help="sources per unified key")
+    parser.add_argument("--raw", type=int, default=2000, help="raw keys per payload")
+    args = parser.parse_args()
+    main(args.unified, args.sources, args.raw)
@@ -0,0 +1,97 @@
+# debug/bench_mapping_patterns.py
+# Benchmark: pattern sources (project_config.mapping_rules) vs the exact-only
+# source index.
+# 1. Per-row CSV keys: one "glob:row*.<metric>" rule per metric vs one exact source
+#    per row and metric (registry size, load + index time, lookup time).
+# 2. Many glob rules: the segment trie vs trying every rule's regex in turn, as the
+#    rule count grows.
+# Checks that both sides map every key the same way before timing.
+#
+# Usage: python debug/bench_mapping_patterns.py [--rows 5000] [--metrics 20] [--keys 20000]
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import json
+import random
+import re
+import tempfile
+import time
+
+from project_config.mapping_rules import PatternMatcher, _segment_regex
+from project_config.metric_mapping import MappingRegistry
+
+
+def timed_ms(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, (time.perf_counter() - start) * 1000
+
+
+def load(tmp: str, name: str, mapping: dict):
+    path = os.path.join(tmp, name)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(mapping, f, indent=2)
+    registry = MappingRegistry(path, first_wins=True)
+    _, build_ms = timed_ms(registry.refresh)
+    return registry, os.path.getsize(path), build_ms
+
+
+def per_row_keys(n_rows: int, n_metrics: int, n_keys: int) -> None:
+    metrics = [f"metric_{m}" for m in range(n_metrics)]
+    exact = {f"csv.{m}": {"tags": [], "sources": [f"row{r}.{m}" for r in range(n_rows)]} for m in metrics}
+    patterns = {f"csv.{m}": {"tags": [], "sources": [f"glob:row*.{m}"]} for m in metrics}
+    rnd = random.Random(23)
+    keys = [f"row{rnd.randrange(n_rows)}.{rnd.choice(metrics)}" for _ in range(n_keys)]
+    keys += [f"other{i}.value" for i in range(n_keys // 10)]  # unmapped
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"1) {n_rows} CSV rows x {n_metrics} metrics, {len(keys)} lookups")
+        print(f"{'registry':>14} {'sources':>9} {'file KB':>9} {'load ms':>9} {'lookup ms':>10} {'again ms':>10}")
+        results = {}
+        for name, mapping in (("exact-only", exact), ("glob rules", patterns)):
+            registry, size, build_ms = load(tmp, f"{name}.json", mapping)
+            resolve = registry.resolver()
+            results[name], lookup_ms = timed_ms(lambda: [resolve(k) for k in keys])
+            _, again_ms = timed_ms(lambda: [resolve(k) for k in keys])
+            n_sources = sum(len(v["sources"]) for v in mapping.values())
+            print(f"{name:>14} {n_sources:>9} {size / 1024:>9.0f} {build_ms:>9.1f} {lookup_ms:>10.1f} {again_ms:>10.1f}")
+        if results["exact-only"] != results["glob rules"]:
+            raise SystemExit("exact-only and pattern registries map keys differently")
+
+
+def many_rules(n_keys: int) -> None:
+    print(f"\n2) glob rules 'glob:{{dc}}.metric_<i>' (one segment pattern, one literal), {n_keys} lookups")
+    print(f"{'rules':>7} {'trie ms':>9} {'each rule ms':>13} {'speedup':>8}")
+    rnd = random.Random(23)
+    for n_rules in (10, 100, 1000, 5000):
+        sources = [f"{{dc}}.metric_{i}" for i in range(n_rules)]
+        matcher = PatternMatcher()
+        for i, src in enumerate(sources):
+            matcher.add("glob:" + src, {"unified_key": f"u{i}"})
+        compiled = [(re.compile(r"\.".join(_segment_regex(s) for s in src.split("."))), {"unified_key": f"u{i}"})
+                    for i, src in enumerate(sources)]
+
+        def each_rule(key):
+            for regex, entry in compiled:
+                if regex.fullmatch(key):
+                    return entry
+            return None
+
+        keys = [f"dc{rnd.randrange(50)}.metric_{rnd.randrange(n_rules * 2)}" for _ in range(n_keys)]
+        trie, trie_ms = timed_ms(lambda: [matcher._match(k) for k in keys])  # uncached
+        naive, naive_ms = timed_ms(lambda: [each_rule(k) for k in keys])
+        if trie != naive:
+            raise SystemExit("trie and per-rule matching differ")
+        print(f"{n_rules:>7} {trie_ms:>9.1f} {naive_ms:>13.1f} {naive_ms / trie_ms:>7.0f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark pattern sources against the exact-only index.")
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--metrics", type=int, default=20)
+    parser.add_argument("--keys", type=int, default=20000)
+    args = parser.parse_args()
+    per_row_keys(args.rows, args.metrics, args.keys)
+    many_rules(args.keys // 4)
@@ -0,0 +1,129 @@
+# debug/bench_mapping_sync.py
+# Benchmark / check for utils.mapping_sync.MappingStore.
+# 1. Concurrency: several processes add sources to the same file at once,
+#    per key; counts lost updates with the store and with the previous
+#    unlocked load + rewrite.
+# 2. Batching: adding many new sources to a large file per key (one locked
+#    read + write each) vs one add_sources() batch.
+# 3. Visibility: a source added through the store is returned by a loaded
+#    MappingRegistry's resolver(), and the module-level store writes the file
+#    project_config.metric_mapping.registry reads.
+#
+# Usage: python debug/bench_mapping_sync.py [--writers 4] [--keys 200] [--existing 5000]
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import json
+import multiprocessing
+import tempfile
+import time
+
+from project_config import metric_mapping
+from project_config.metric_mapping import MappingRegistry
+from utils import mapping_sync
+from utils.mapping_sync import MappingStore
+
+
+def old_sync(path: str, unified_key: str, source_key: str, tags: list) -> None:
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            try:
+                mapping = json.load(f)
+            except ValueError:  # caught the other writer mid-write
+                mapping = {}
+    else:
+        mapping = {}
+    entry = mapping.setdefault(unified_key, {"tags": list(tags), "sources": []})
+    if source_key not in entry["sources"]:
+        entry["sources"].append(source_key)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(mapping, f, indent=2)
+
+
+def writer(args) -> None:
+    path, use_store, worker, n_keys = args
+    store = MappingStore(path)
+    for i in range(n_keys):
+        unified_key = f"std.bench.worker_{worker}"
+        source_key = f"dc{worker}.metric_{i}"
+        if use_store:
+            store.add_sources([(unified_key, source_key, ["bench"])])
+        else:
+            old_sync(path, unified_key, source_key, ["bench"])
+
+
+def concurrency(n_writers: int, n_keys: int) -> None:
+    print(f"1) {n_writers} processes x {n_keys} sources each, one update per source")
+    for name, use_store in (("previous", False), ("MappingStore", True)):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "metric_mapping.json")
+            start = time.perf_counter()
+            with multiprocessing.Pool(n_writers) as pool:
+                pool.map(writer, [(path, use_store, w, n_keys) for w in range(n_writers)])
+            elapsed = time.perf_counter() - start
+            try:
+                mapping = MappingStore(path).load()
+                kept = sum(len(v["sources"]) for v in mapping.values())
+            except ValueError:
+                kept = 0
+            print(f"  {name:>13}: {kept:>6} of {n_writers * n_keys} sources kept, {elapsed:6.2f} s")
+            if use_store and kept != n_writers * n_keys:
+                raise SystemExit("MappingStore lost updates")
+
+
+def batching(n_existing: int, n_keys: int) -> None:
+    base = {f"std.category_{u % 40}.metric_{u}": {"tags": ["bench"], "sources": [f"dc0.metric_{u}"]}
+            for u in range(n_existing)}
+    updates = [(f"std.new.metric_{i}", f"dc1.metric_{i}", ["new"]) for i in range(n_keys)]
+    print(f"\n2) {n_keys} new sources into a file with {n_existing} unified keys")
+    for name in ("per key", "one batch", "no-op batch"):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "metric_mapping.json")
+            store = MappingStore(path)
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(base, f, indent=2)
+            if name == "no-op batch":
+                store.add_sources(updates)
+            start = time.perf_counter()
+            if name == "per key":
+                for update in updates:
+                    store.add_sources([update])
+            else:
+                store.add_sources(updates)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            if len(store.load()) != n_existing + n_keys:
+                raise SystemExit("batch and per-key results differ")
+            print(f"  {name:>13}: {elapsed_ms:9.1f} ms")
+
+
+def visibility() -> None:
+    print("\n3) store writes seen by a loaded registry")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "metric_mapping.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"std.cpu": {"tags": ["cpu"], "sources": ["dc0.cpu"]}}, f, indent=2)
+        registry = MappingRegistry(path, first_wins=True)
+        if registry.resolver()("dc1.cpu") is not None:
+            raise SystemExit("dc1.cpu mapped before it was added")
+        MappingStore(path).add_sources([("std.cpu", "dc1.cpu", ["cpu"])])
+        if registry._stamp is not None:
+            raise SystemExit("the registry was not invalidated by the write")
+        entry = registry.resolver()("dc1.cpu")
+        if entry is None or entry["unified_key"] != "std.cpu":
+            raise SystemExit(f"source added through MappingStore not visible through resolver(): {entry}")
+    if os.path.abspath(mapping_sync.store.path) != os.path.abspath(metric_mapping.registry.path):
+        raise SystemExit(f"mapping_sync writes {mapping_sync.store.path}, the registry reads {metric_mapping.registry.path}")
+    print("  ok: invalidated on write, new source resolved; mapping_sync and registry share the file")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check and benchmark the locked, atomic mapping store.")
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--keys", type=int, default=200, help="sources per writer / per batch")
+    parser.add_argument("--existing", type=int, default=5000, help="unified keys already in the file")
+    args = parser.parse_args()
+    concurrency(args.writers, args.keys)
+    batching(args.existing, args.keys)
+    visibility()
@@ -5,7 +5,7 @@ import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 import datetime
-from namespace_mapper import map_raw_metric
+from namespace_mapper import map_raw_metrics
 from project_services.influx_service import write_mapped_metrics
 
 # Simulated AWS metric values (replace with real SDK/API calls)
@@ -18,13 +18,9 @@ aws_metrics = {
 
 def fetch_and_store_aws_metrics():
     timestamp = datetime.datetime.utcnow().isoformat()
-    mapped = []
-
-    for raw_key, value in aws_metrics.items():
-        unified = map_raw_metric(raw_key, value, datacenter="aws")
-        if unified:
-            unified["timestamp"] = timestamp
-            mapped.append(unified)
+    mapped = map_raw_metrics(aws_metrics, datacenter="aws")
+    for unified in mapped:
+        unified["timestamp"] = timestamp
 
     if mapped:
         write_mapped_metrics(mapped)
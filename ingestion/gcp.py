@@ -5,7 +5,7 @@ import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 import datetime
-from namespace_mapper import map_raw_metric
+from namespace_mapper import map_raw_metrics
 from project_services.influx_service import write_mapped_metrics
 
 # Simulated GCP metric values (replace with real API fetch logic)
@@ -18,13 +18,9 @@ gcp_metrics = {
 
 def fetch_and_store_gcp_metrics():
     timestamp = datetime.datetime.utcnow().isoformat()
-    mapped = []
-
-    for raw_key, value in gcp_metrics.items():
-        unified = map_raw_metric(raw_key, value, datacenter="gcp")
-        if unified:
-            unified["timestamp"] = timestamp
-            mapped.append(unified)
+    mapped = map_raw_metrics(gcp_metrics, datacenter="gcp")
+    for unified in mapped:
+        unified["timestamp"] = timestamp
 
     if mapped:
         write_mapped_metrics(mapped)
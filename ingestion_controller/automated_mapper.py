@@ -2,95 +2,146 @@ import sys
 import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from sql_services.namespace_generator import generate_namespace
-from sql_services.insert_mapped_metric import insert_mapped_metric
-from utils.mapping_sync import sync_metric_mapping
+from sql_services.namespace_generator import namespace_cache
+from sql_services.insert_mapped_metric import insert_mapped_metrics
+from utils.mapping_sync import sync_metric_mappings
 from project_models.metric_keyword import MetricKeyword
 from project_config.postgres_config import SessionLocal
 from ingestion_controller.semantic_classifier import classify_by_semantics
 
-def classify_metric(raw_key: str) -> tuple:
-    # First: try semantic classifier (standards-based)
-    semantic_result = classify_by_semantics(raw_key)
-    if semantic_result:
-        return semantic_result
+UNCATEGORIZED = ("uncategorized", "unknown", "unknown")
+
+def guess_metric(key: str) -> tuple:
+    # fallback guess (basic keyword rules)
+    if "cpu" in key:
+        return ("performance", "cpu", "utilization")
+    elif "mem" in key:
+        return ("performance", "memory", "usage")
+    elif "net" in key or "traffic" in key:
+        if "out" in key or "tx" in key:
+            return ("network", "traffic", "outgoing")
+        else:
+            return ("network", "traffic", "incoming")
+    elif "power" in key and "solar" not in key:
+        return ("energy", "power", "total")
+    elif "solar" in key:
+        return ("energy", "renewable", "solar")
+    elif "disk" in key:
+        if "read" in key:
+            return ("storage", "disk", "read_io")
+        elif "write" in key:
+            return ("storage", "disk", "write_io")
+        else:
+            return ("storage", "disk", "usage")
+    elif "temp" in key or "therm" in key:
+        return ("environment", "temperature", "ambient")
+    else:
+        return UNCATEGORIZED
+
+def classify_metrics(raw_keys) -> dict:
+    """
+    {raw_key: (category, subcategory, short_key)} for all keys of a file at once:
+    semantic classifier first, then one IN query on metric_keywords, then the
+    keyword rules, whose guesses are stored for learning in a single commit.
+    """
+    results = {}
+    pending = {}  # lowercased key -> raw keys
+    for raw_key in raw_keys:
+        # First: try semantic classifier (standards-based)
+        semantic_result = classify_by_semantics(raw_key)
+        if semantic_result:
+            results[raw_key] = semantic_result[1:]  # (standard, category, ...): the standard comes from the category
+        else:
+            pending.setdefault(raw_key.lower(), []).append(raw_key)
+    if not pending:
+        return results
 
     # Second: try keyword DB
     session = SessionLocal()
     try:
-        key = raw_key.lower()
-        keyword_hit = session.query(MetricKeyword).filter(MetricKeyword.source_key == key).first()
-        if keyword_hit:
-            return keyword_hit.category, keyword_hit.subcategory, keyword_hit.short_key
-        else:
-            # fallback guess (basic keyword rules)
-            if "cpu" in key:
-                guess = ("performance", "cpu", "utilization")
-            elif "mem" in key:
-                guess = ("performance", "memory", "usage")
-            elif "net" in key or "traffic" in key:
-                if "out" in key or "tx" in key:
-                    guess = ("network", "traffic", "outgoing")
-                else:
-                    guess = ("network", "traffic", "incoming")
-            elif "power" in key and "solar" not in key:
-                guess = ("energy", "power", "total")
-            elif "solar" in key:
-                guess = ("energy", "renewable", "solar")
-            elif "disk" in key:
-                if "read" in key:
-                    guess = ("storage", "disk", "read_io")
-                elif "write" in key:
-                    guess = ("storage", "disk", "write_io")
-                else:
-                    guess = ("storage", "disk", "usage")
-            elif "temp" in key or "therm" in key:
-                guess = ("environment", "temperature", "ambient")
-            else:
-                guess = ("uncategorized", "unknown", "unknown")
+        hits = {}
+        rows = (
+            session.query(MetricKeyword)
+            .filter(MetricKeyword.source_key.in_(list(pending)))
+            .order_by(MetricKeyword.id)
+            .all()
+        )
+        for row in rows:
+            hits.setdefault(row.source_key, (row.category, row.subcategory, row.short_key))
 
-            # Store guessed keyword for learning
-            if guess[0] != "uncategorized":
-                new_entry = MetricKeyword(
-                    keyword=key,
-                    category=guess[0],
-                    subcategory=guess[1],
-                    short_key=guess[2],
-                    confidence=0.3,
-                    source_key=key
-                )
-                session.add(new_entry)
-                session.commit()
-
-            return guess
+        new_entries = []
+        for key, keys in pending.items():
+            classification = hits.get(key)
+            if classification is None:
+                classification = guess_metric(key)
+                # Store guessed keyword for learning
+                if classification[0] != "uncategorized":
+                    new_entries.append(MetricKeyword(
+                        keyword=key,
+                        category=classification[0],
+                        subcategory=classification[1],
+                        short_key=classification[2],
+                        confidence=0.3,
+                        source_key=key
+                    ))
+            for raw_key in keys:
+                results[raw_key] = classification
+        if new_entries:
+            session.add_all(new_entries)
+            session.commit()
     except Exception as e:
-        print(f"❌ Error classifying metric: {e}")
-        return ("uncategorized", "unknown", "unknown")
+        print(f"❌ Error classifying metrics: {e}")
+        session.rollback()
+        for keys in pending.values():
+            for raw_key in keys:
+                results.setdefault(raw_key, UNCATEGORIZED)
     finally:
         session.close()
+    return results
 
-def process_new_raw_metric(raw_key: str) -> str:
-    category, subcategory, metric_short_key = classify_metric(raw_key)
+def classify_metric(raw_key: str) -> tuple:
+    return classify_metrics([raw_key])[raw_key]
 
-    if category == "uncategorized":
-        print(f"⚠️ Unable to classify raw metric: {raw_key}")
-        return raw_key
+def process_new_raw_metrics(raw_keys) -> dict:
+    """
+    Classifies and maps all raw keys of a file at once; returns
+    {raw_key: unified_key}, with the raw key itself for keys that could not be
+    classified or whose category / subcategory is not in the database.
+    """
+    classified = classify_metrics(raw_keys)
+    namespaces = namespace_cache.resolve_many(
+        c for c in classified.values() if c[0] != "uncategorized"
+    )
 
-    unified_key = generate_namespace(category, subcategory, metric_short_key)
-    tags = list(set([category, subcategory, metric_short_key]))
+    unified_keys = {}
+    definitions = {}
+    for raw_key, classification in classified.items():
+        category, subcategory, metric_short_key = classification
+        if category == "uncategorized":
+            print(f"⚠️ Unable to classify raw metric: {raw_key}")
+            unified_keys[raw_key] = raw_key
+            continue
+        unified_key = namespaces.get(classification)
+        if unified_key is None:
+            print(f"⚠️ Unable to map raw metric {raw_key}: {namespace_cache.explain(category, subcategory)}")
+            unified_keys[raw_key] = raw_key
+            continue
+        unified_keys[raw_key] = unified_key
+        definition = definitions.setdefault(unified_key, {"sources": [], "tags": set()})
+        definition["sources"].append(raw_key)
+        definition["tags"].update(classification)
 
     # Insert into relational DB
-    insert_mapped_metric(
-        unified_key=unified_key,
-        source_keys=[raw_key],
-        tags=tags
-    )
+    insert_mapped_metrics(definitions)
 
     # Sync to JSON file
-    sync_metric_mapping(
-        unified_key=unified_key,
-        source_key=raw_key,
-        tags=tags
+    sync_metric_mappings(
+        (unified_key, raw_key, sorted(definition["tags"]))
+        for unified_key, definition in definitions.items()
+        for raw_key in definition["sources"]
     )
 
-    return unified_key
+    return unified_keys
+
+def process_new_raw_metric(raw_key: str) -> str:
+    return process_new_raw_metrics([raw_key])[raw_key]
@@ -9,7 +9,7 @@ from project_services.influx_service import write_mapped_metrics
 from sql_services.insert_file_upload_log import insert_file_upload_log
 from sql_services.insert_metric_definition import insert_metric_definition
 from sql_services.insert_datacenter import insert_datacenter
-from ingestion_controller.automated_mapper import process_new_raw_metric
+from ingestion_controller.automated_mapper import process_new_raw_metrics
 from datetime import datetime
 
 SUPPORTED_FILE_TYPES = [".json", ".xml", ".csv", ".yaml", ".txt"]
@@ -27,11 +27,11 @@ def ingest_from_file(file_path: str, datacenter_name: str, uploaded_by: str = No
     print("📂 Parsed file, now mapping metrics...")
     raw_metrics, mapped_metrics = parse_and_extract_file_metrics(file_path, datacenter_name)
     print(f"🔍 Raw metrics: {list(raw_metrics.keys())}")
+    print(f"🚀 Classifying + mapping {len(raw_metrics)} raw metrics")
+    unified_keys = process_new_raw_metrics(list(raw_metrics))
     new_mapped_metrics = {}
     for raw_key, value in raw_metrics.items():
-        st.write(f"🚀 Classifying + mapping: {raw_key}")
-        unified_key = process_new_raw_metric(raw_key)
-        new_mapped_metrics[unified_key] = value
+        new_mapped_metrics[unified_keys[raw_key]] = value
 
     # Write to InfluxDB
     timestamp = datetime.utcnow()
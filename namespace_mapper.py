@@ -7,8 +7,15 @@ import xml.etree.ElementTree as ET
 from pathlib import Path
 from typing import Dict, Any, List, Optional
 
-# Path to your mapping registry file
-MAPPING_FILE = Path("project_config/metric_mapping.json")
+from project_config import metric_mapping
+from project_config.metric_mapping import MappingRegistry
+from utils.flatten import flatten
+
+# Path to your mapping registry file (the one utils.mapping_sync writes)
+MAPPING_FILE = Path(metric_mapping.MAPPING_FILE)
+
+# Loaded and inverted once, reloaded when the file changes
+registry = MappingRegistry(MAPPING_FILE)
 
 
 def load_mapping_registry() -> Dict[str, Any]:
@@ -26,33 +33,36 @@ def build_inverse_mapping(mapping: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
     return inverse
 
 
+def _mapped(entry: Dict[str, Any], raw_key: str, value: Any, datacenter: str) -> Dict[str, Any]:
+    return {
+        "unified_key": entry["unified_key"],
+        "value": try_cast(value),
+        "datacenter": datacenter,
+        "source_key": raw_key,
+        "tags": entry["tags"]
+    }
+
+
 def map_raw_metric(raw_key: str, value: Any, datacenter: str) -> Optional[Dict[str, Any]]:
-    mapping = load_mapping_registry()
-    inverse_mapping = build_inverse_mapping(mapping)
-    if raw_key in inverse_mapping:
-        return {
-            "unified_key": inverse_mapping[raw_key]["unified_key"],
-            "value": try_cast(value),
-            "datacenter": datacenter,
-            "source_key": raw_key,
-            "tags": inverse_mapping[raw_key]["tags"]
-        }
-    return None
+    entry = registry.lookup(raw_key)
+    if entry is None:
+        return None
+    return _mapped(entry, raw_key, value, datacenter)
+
+
+def map_raw_metrics(raw_metrics: Dict[str, Any], datacenter: str) -> List[Dict[str, Any]]:
+    """Map a whole {raw_key: value} dict against one version of the registry; unmapped keys are left out."""
+    resolve = registry.resolver()
+    result = []
+    for raw_key, value in raw_metrics.items():
+        entry = resolve(raw_key)
+        if entry is not None:
+            result.append(_mapped(entry, raw_key, value, datacenter))
+    return result
 
 
 def flatten_json(obj: Any, parent_key: str = "", sep: str = ".") -> Dict[str, Any]:
-    items = {}
-    if isinstance(obj, dict):
-        for k, v in obj.items():
-            new_key = f"{parent_key}{sep}{k}" if parent_key else k
-            items.update(flatten_json(v, new_key, sep))
-    elif isinstance(obj, list):
-        for i, v in enumerate(obj):
-            new_key = f"{parent_key}{sep}{i}"
-            items.update(flatten_json(v, new_key, sep))
-    else:
-        items[parent_key] = obj
-    return items
+    return flatten({parent_key: obj} if parent_key else obj, sep=sep)
 
 
 def flatten_xml(elem: ET.Element, parent_key: str = "", sep: str = ".") -> Dict[str, Any]:
@@ -112,13 +122,7 @@ def extract_metrics(file_path: str, datacenter: str, sep: str = ".") -> List[Dic
     else:
         raise ValueError("Unsupported format")
 
-    result = []
-    for raw_key, value in flat_data.items():
-        mapped = map_raw_metric(raw_key, value, datacenter)
-        if mapped:
-            result.append(mapped)
-
-    return result
+    return map_raw_metrics(flat_data, datacenter)
 
 
 def try_cast(val: Any):
@@ -5,15 +5,15 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from parsers.structured_parser import parse_structured_file
 from parsers.unstructured_parser import parse_unstructured_text
-from project_config.metric_mapping import unified_metric_mapping
+from project_config.metric_mapping import registry
 
 def extract_metrics(raw_metrics: dict, datacenter: str) -> dict:
+    resolve = registry.resolver()
     mapped = {}
     for raw_key, value in raw_metrics.items():
-        for unified_key, config in unified_metric_mapping.items():
-            if raw_key in config.get("sources", []):
-                mapped[unified_key] = value
-                break
+        entry = resolve(raw_key)
+        if entry is not None:
+            mapped[entry["unified_key"]] = value
     return mapped
 
 def parse_and_extract_file_metrics(filepath: str, datacenter: str = "naive") -> dict:
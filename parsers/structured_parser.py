@@ -7,17 +7,12 @@ import json
 import yaml
 import csv
 import xml.etree.ElementTree as ET
-from collections.abc import MutableMapping
+
+from utils.flatten import flatten
 
 def flatten_dict(d, parent_key='', sep='.') -> dict:
-    items = []
-    for k, v in d.items():
-        new_key = f"{parent_key}{sep}{k}" if parent_key else k
-        if isinstance(v, MutableMapping):
-            items.extend(flatten_dict(v, new_key, sep=sep).items())
-        else:
-            items.append((new_key, v))
-    return dict(items)
+    # Lists are kept as values here
+    return flatten({parent_key: d} if parent_key else d, sep=sep, lists=False)
 
 def parse_structured_file(filepath: str) -> dict:
     ext = os.path.splitext(filepath)[-1].lower()
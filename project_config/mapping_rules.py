@@ -0,0 +1,176 @@
+# mapping_rules.py
+# Purpose: pattern sources in metric_mapping.json, next to exact source keys.
+# - glob:  "glob:row*.cpu_usage"  (* and ? stay within one dot-separated
+#          segment, a "**" segment spans any number of segments, [abc] is a
+#          class, {name} is one or more characters of a single segment, as in
+#          "glob:{dc}.cpu")
+# - regex: "re:^gamma\.(sys|system)\.cpu\w*$"  (matched against the whole key)
+# Only sources with one of these prefixes are patterns; any other source is an
+# exact key, even if it contains * ? [ or { (e.g. "disk[0].usage").
+# Glob rules are compiled into one trie over key segments, so a lookup walks
+# the key's segments instead of trying every rule. Regex rules are compiled and
+# validated when added; plain ones are combined into a single alternation,
+# those with named groups, inline flags or backreferences (which an
+# alternation would break) are matched one by one. Exact sources are looked up
+# first (see metric_mapping.MappingRegistry) and always win over patterns.
+
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+SEP = "."
+GLOB_PREFIX = "glob:"
+REGEX_PREFIX = "re:"
+# Results of match() are memoized per matcher: ingesters see the same keys every run
+MATCH_CACHE_SIZE = 65536
+_PATTERN_CHARS = re.compile(r"[*?\[{]")
+_TOKEN = re.compile(r"\{[^{}]*\}|\*|\?|\[[^\]]*\]|[^*?\[{]+|.")
+# Group references that would point at the wrong group once rules are combined
+_GROUP_REFS = re.compile(r"\\[1-9]|\(\?P=|\(\?\(")
+_DEFAULT_FLAGS = re.compile("").flags
+
+
+def is_pattern(source: str) -> bool:
+    return source.startswith(GLOB_PREFIX) or source.startswith(REGEX_PREFIX)
+
+
+def _segment_regex(segment: str) -> str:
+    out = []
+    for token in _TOKEN.findall(segment):
+        if token == "*":
+            out.append(".*")
+        elif token == "?":
+            out.append(".")
+        elif token.startswith("[") and token.endswith("]") and len(token) > 2:
+            out.append("[^" + token[2:] if token.startswith("[!") else token)
+        elif token.startswith("{") and token.endswith("}"):
+            out.append(".+")
+        else:  # literal text, or a stray [ { without its closing bracket
+            out.append(re.escape(token))
+    return "".join(out)
+
+
+class _Node:
+    __slots__ = ("exact", "patterns", "deep", "rules")
+
+    def __init__(self):
+        self.exact: Dict[str, "_Node"] = {}
+        self.patterns: Dict[str, Tuple[Any, "_Node"]] = {}  # segment regex -> (compiled, node)
+        self.deep: Optional["_Node"] = None                  # "**" segment
+        self.rules: List[Tuple[int, Dict[str, Any]]] = []   # (rule order, entry) ending here
+
+
+class PatternMatcher:
+    """Glob rules in a segment trie plus regex rules; matching returns the entry of the first (or last) rule."""
+
+    def __init__(self, first_wins: bool = True):
+        self.first_wins = first_wins
+        self._root = _Node()
+        self._regexes: List[Tuple[int, str, Dict[str, Any]]] = []     # combined into one alternation
+        self._separate: List[Tuple[int, Any, Dict[str, Any]]] = []    # matched one by one
+        self._combined = None
+        self._count = 0
+        self._cache: Dict[str, Optional[Dict[str, Any]]] = {}
+
+    def __len__(self) -> int:
+        return self._count
+
+    def add(self, source: str, entry: Dict[str, Any]) -> None:
+        """Adds a "glob:" or "re:" rule; raises ValueError for anything else or a rule that does not compile."""
+        if source.startswith(REGEX_PREFIX):
+            pattern = source[len(REGEX_PREFIX):]
+            try:
+                compiled = re.compile(pattern)
+            except re.error as e:
+                raise ValueError(f"invalid regex rule {source!r}: {e}") from None
+            order = self._next_order()
+            if compiled.groupindex or compiled.flags != _DEFAULT_FLAGS or _GROUP_REFS.search(pattern):
+                self._separate.append((order, compiled, entry))
+            else:
+                self._regexes.append((order, pattern, entry))
+                self._combined = None
+            return
+        if not source.startswith(GLOB_PREFIX):
+            raise ValueError(f"not a pattern rule (expected a {GLOB_PREFIX!r} or {REGEX_PREFIX!r} prefix): {source!r}")
+        path = []
+        for segment in source[len(GLOB_PREFIX):].split(SEP):
+            if segment != "**" and _PATTERN_CHARS.search(segment):
+                regex = _segment_regex(segment)
+                try:
+                    path.append((regex, re.compile(regex)))
+                except re.error as e:
+                    raise ValueError(f"invalid glob rule {source!r}: {e}") from None
+            else:
+                path.append((segment, None))
+        order = self._next_order()
+        node = self._root
+        for segment, compiled in path:
+            if compiled is not None:
+                # Keyed by the regex, so "{dc}" and "{site}" share a node
+                if segment not in node.patterns:
+                    node.patterns[segment] = (compiled, _Node())
+                node = node.patterns[segment][1]
+            elif segment == "**":
+                node.deep = node.deep or _Node()
+                node = node.deep
+            else:
+                node = node.exact.setdefault(segment, _Node())
+        node.rules.append((order, entry))
+
+    def _next_order(self) -> int:
+        order = self._count
+        self._count += 1
+        self._cache.clear()
+        return order
+
+    def _compile_regexes(self):
+        # Alternatives are tried in rule order; with last-wins, reverse them
+        rules = self._regexes if self.first_wins else self._regexes[::-1]
+        parts = [f"(?P<_rule{i}>{pattern})" for i, (_, pattern, _) in enumerate(rules)]
+        self._combined = (re.compile("|".join(parts)), rules) if parts else (None, [])
+
+    def _walk(self, node: _Node, segments: List[str], i: int, found: List[Tuple[int, Dict[str, Any]]]) -> None:
+        if i == len(segments):
+            found.extend(node.rules)
+            if node.deep is not None:
+                self._walk(node.deep, segments, i, found)
+            return
+        segment = segments[i]
+        child = node.exact.get(segment)
+        if child is not None:
+            self._walk(child, segments, i + 1, found)
+        for compiled, child in node.patterns.values():
+            if compiled.fullmatch(segment):
+                self._walk(child, segments, i + 1, found)
+        if node.deep is not None:
+            # "**" consumes segments i..j-1, for every j
+            for j in range(i, len(segments) + 1):
+                self._walk(node.deep, segments, j, found)
+
+    def match(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+        if len(self._cache) >= MATCH_CACHE_SIZE:
+            self._cache.clear()
+        result = self._cache[key] = self._match(key)
+        return result
+
+    def _match(self, key: str) -> Optional[Dict[str, Any]]:
+        found: List[Tuple[int, Dict[str, Any]]] = []
+        self._walk(self._root, key.split(SEP), 0, found)
+        if self._regexes:
+            if self._combined is None:
+                self._compile_regexes()
+            combined, rules = self._combined
+            m = combined.fullmatch(key)
+            if m is not None:
+                # lastgroup is the outermost named group that matched, i.e. the alternative
+                order, _, entry = rules[int(m.lastgroup[len("_rule"):])]
+                found.append((order, entry))
+        for order, compiled, entry in self._separate:
+            if compiled.fullmatch(key):
+                found.append((order, entry))
+        if not found:
+            return None
+        return (min if self.first_wins else max)(found, key=lambda r: r[0])[1]
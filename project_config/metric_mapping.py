@@ -1,9 +1,142 @@
 # metric_mapping.py
 
+import hashlib
 import json
 import os
+import threading
+import weakref
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from project_config.mapping_rules import PatternMatcher, is_pattern
 
 MAPPING_FILE = os.path.join(os.path.dirname(__file__), "metric_mapping.json")
 
-with open(MAPPING_FILE, "r", encoding="utf-8") as f:
-    unified_metric_mapping = json.load(f)
+# Every MappingRegistry, for invalidate_path()
+_registries: "weakref.WeakSet[MappingRegistry]" = weakref.WeakSet()
+
+
+class MappingRegistry:
+    """
+    A mapping file ({unified_key: {"tags": [...], "sources": [...]}}) loaded once
+    and inverted into a source -> {"unified_key", "tags"} hash index.
+
+    Pattern sources ("glob:" and "re:" rules, see mapping_rules) are compiled
+    into a PatternMatcher; exact sources always take priority over them. A rule
+    that does not compile is skipped with a warning.
+
+    The file is stat()ed on access and re-read only when its mtime or size
+    changed; the index is rebuilt only when the content hash changed too. A new
+    (mapping, index) pair replaces the old one in a single assignment, so
+    readers never see a half-built index. A file that does not parse (e.g.
+    edited by hand) keeps the previous version, with a warning, until the next
+    access; on the first load there is no previous version and ValueError is
+    raised instead.
+
+    first_wins: when a source is listed under several unified keys, map it to
+    the first one (default: the last one, like build_inverse_mapping).
+    """
+
+    def __init__(self, path, first_wins: bool = False):
+        self.path = path
+        self.first_wins = first_wins
+        self._lock = threading.Lock()
+        self._stamp: Optional[Tuple[int, int]] = None
+        self._digest: Optional[str] = None
+        self._bad_stamp: Optional[Tuple[int, int]] = None  # last invalid version reported
+        self._state: Tuple[Dict[str, Any], Dict[str, Dict[str, Any]], PatternMatcher] = ({}, {}, PatternMatcher())
+        _registries.add(self)
+
+    def _build_index(self, mapping: Dict[str, Any]) -> Tuple[Dict[str, Dict[str, Any]], PatternMatcher]:
+        index: Dict[str, Dict[str, Any]] = {}
+        patterns = PatternMatcher(first_wins=self.first_wins)
+        for unified_key, data in mapping.items():
+            entry = {"unified_key": unified_key, "tags": data.get("tags", [])}
+            for src in data.get("sources", []):
+                if is_pattern(src):
+                    try:
+                        patterns.add(src, entry)
+                    except ValueError as e:
+                        # One bad rule must not take down the rest of the file
+                        print(f"⚠️ Skipping source of {unified_key} in {self.path}: {e}")
+                elif self.first_wins:
+                    index.setdefault(src, entry)
+                else:
+                    index[src] = entry
+        return index, patterns
+
+    def refresh(self) -> bool:
+        """Reload if the file changed; returns True when a new version was loaded."""
+        st = os.stat(self.path)
+        stamp = (st.st_mtime_ns, st.st_size)
+        if stamp == self._stamp:
+            return False
+        with self._lock:
+            if stamp == self._stamp:
+                return False
+            with open(self.path, "rb") as f:
+                raw = f.read()
+            digest = hashlib.sha1(raw).hexdigest()
+            if digest == self._digest:
+                self._stamp = stamp
+                return False
+            try:
+                mapping = json.loads(raw)
+                if not isinstance(mapping, dict):
+                    raise ValueError("top level is not an object")
+            except ValueError as e:
+                if self._digest is None:
+                    # Nothing to fall back on: every metric would silently come out unmapped
+                    raise ValueError(f"{self.path} is not a valid mapping file: {e}") from e
+                if stamp != self._bad_stamp:
+                    print(f"⚠️ {self.path} is not a valid mapping file, keeping the previous version: {e}")
+                    self._bad_stamp = stamp
+                return False
+            self._state = (mapping, *self._build_index(mapping))
+            self._digest, self._stamp = digest, stamp
+            return True
+
+    def invalidate(self) -> None:
+        """Force a stat() + hash check on the next access (e.g. after writing the file)."""
+        self._stamp = None
+
+    @property
+    def mapping(self) -> Dict[str, Any]:
+        self.refresh()
+        return self._state[0]
+
+    @property
+    def index(self) -> Dict[str, Dict[str, Any]]:
+        """Exact sources only."""
+        self.refresh()
+        return self._state[1]
+
+    def resolver(self) -> Callable[[str], Optional[Dict[str, Any]]]:
+        """lookup() bound to the current version of the file, to map a whole payload consistently."""
+        self.refresh()
+        _, index, patterns = self._state
+        if not len(patterns):
+            return index.get
+
+        def resolve(source_key: str) -> Optional[Dict[str, Any]]:
+            entry = index.get(source_key)
+            return entry if entry is not None else patterns.match(source_key)
+        return resolve
+
+    def lookup(self, source_key: str) -> Optional[Dict[str, Any]]:
+        return self.resolver()(source_key)
+
+
+def invalidate_path(path) -> None:
+    """Called by writers of a mapping file (utils.mapping_sync): registries of that file re-check it on next access."""
+    target = os.path.abspath(path)
+    for registry in list(_registries):
+        if os.path.abspath(registry.path) == target:
+            registry.invalidate()
+
+
+# Source -> unified key index of this directory's metric_mapping.json.
+# First wins when a source is listed twice, as in namespace_mapper_core.extract_metrics.
+registry = MappingRegistry(MAPPING_FILE, first_wins=True)
+
+# Snapshot taken at import; registry.mapping follows later changes to the file
+unified_metric_mapping = registry.mapping
@@ -2,32 +2,50 @@ import sys
 import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+from sqlalchemy import literal_column
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session
 from sql_models.metric_definition import MetricDefinition
 from project_config.postgres_config import SessionLocal
 
-def insert_mapped_metric(unified_key: str, source_keys: list, tags: list):
+
+def _merged(column: str):
+    # Union of the stored and the new list, deduplicated
+    return literal_column(
+        f"ARRAY(SELECT DISTINCT x FROM unnest(metric_definitions.{column}::text[] || excluded.{column}::text[]) AS x ORDER BY x)"
+    )
+
+
+def insert_mapped_metrics(definitions: dict):
+    """
+    Upserts {unified_key: {"sources": [...], "tags": [...]}} in one statement;
+    sources and tags of existing definitions are merged with the new ones.
+    """
+    if not definitions:
+        return
+    table = MetricDefinition.__table__
+    rows = [
+        {"unified_key": unified_key, "sources": sorted(set(d["sources"])), "tags": sorted(set(d["tags"]))}
+        for unified_key, d in definitions.items()
+    ]
+    stmt = insert(table).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.unified_key],
+        set_={"sources": _merged("sources"), "tags": _merged("tags")},
+    ).returning(table.c.unified_key, literal_column("(xmax = 0)").label("inserted"))
+
     session: Session = SessionLocal()
     try:
-        # Check if metric already exists
-        metric = session.query(MetricDefinition).filter_by(unified_key=unified_key).first()
-        if metric:
-            metric.sources = list(set((metric.sources or []) + source_keys))
-            metric.tags = list(set((metric.tags or []) + tags))
-            session.commit()
-            print(f"🔁 Updated metric: {unified_key}")
-        else:
-            new_metric = MetricDefinition(
-                unified_key=unified_key,
-                sources=source_keys,
-                tags=tags
-            )
-            session.add(new_metric)
-            session.commit()
-            print(f"✅ Inserted new metric: {unified_key}")
-
+        result = session.execute(stmt).all()
+        session.commit()
+        inserted = sum(1 for row in result if row.inserted)
+        print(f"✅ Inserted {inserted} new metrics, 🔁 updated {len(result) - inserted}")
     except Exception as e:
-        print(f"❌ Error inserting mapped metric: {e}")
+        print(f"❌ Error inserting mapped metrics: {e}")
         session.rollback()
     finally:
         session.close()
+
+
+def insert_mapped_metric(unified_key: str, source_keys: list, tags: list):
+    insert_mapped_metrics({unified_key: {"sources": source_keys, "tags": tags}})
@@ -11,23 +11,73 @@ from project_models.namespace_models import Standard, Category, Subcategory
 engine = create_engine(DATABASE_URL)
 Session = sessionmaker(bind=engine)
 
-def generate_namespace(category_name: str, subcategory_name: str, metric_short_key: str) -> str:
-    session = Session()
 
-    category = session.query(Category).filter_by(name=category_name).first()
-    if not category:
-        raise ValueError(f"Category '{category_name}' not found in database.")
+class NamespaceCache:
+    """
+    standards / categories / subcategories held in memory as
+    {category: (standard or None, {subcategory, ...})}, loaded with one query.
+    Reloaded when a category or subcategory is not found, so rows added after
+    the first load are still picked up.
+    """
 
-    standard = session.query(Standard).filter_by(id=category.standard_id).first()
-    if not standard:
-        raise ValueError(f"No standard found for category '{category_name}'.")
+    def __init__(self):
+        self._tree = None
 
-    subcategory = session.query(Subcategory).filter_by(name=subcategory_name, category_id=category.id).first()
-    if not subcategory:
-        raise ValueError(f"Subcategory '{subcategory_name}' not found for category '{category_name}'.")
+    def load(self) -> None:
+        session = Session()
+        try:
+            rows = (
+                session.query(Category.name, Standard.name, Subcategory.name)
+                .outerjoin(Standard, Standard.id == Category.standard_id)
+                .outerjoin(Subcategory, Subcategory.category_id == Category.id)
+                .all()
+            )
+        finally:
+            session.close()
+        tree = {}
+        for category, standard, subcategory in rows:
+            _, subcategories = tree.setdefault(category, (standard, set()))
+            if subcategory is not None:
+                subcategories.add(subcategory)
+        self._tree = tree  # swapped in whole, readers never see a partial tree
 
-    namespace = f"{standard.name.lower()}.{category.name}.{subcategory.name}.{metric_short_key}"
-    return namespace
+    def _known(self, category_name: str, subcategory_name: str) -> bool:
+        entry = self._tree.get(category_name)
+        return entry is not None and entry[0] is not None and subcategory_name in entry[1]
+
+    def resolve_many(self, triples) -> dict:
+        """
+        {(category, subcategory, metric_short_key): namespace} for every triple
+        that resolves; reloads at most once for the whole batch.
+        """
+        triples = set(triples)
+        if not triples:
+            return {}
+        if self._tree is None or not all(self._known(c, s) for c, s, _ in triples):
+            self.load()
+        namespaces = {}
+        for category_name, subcategory_name, metric_short_key in triples:
+            if self._known(category_name, subcategory_name):
+                standard = self._tree[category_name][0]
+                namespaces[(category_name, subcategory_name, metric_short_key)] = \
+                    f"{standard.lower()}.{category_name}.{subcategory_name}.{metric_short_key}"
+        return namespaces
+
+    def explain(self, category_name: str, subcategory_name: str) -> str:
+        entry = self._tree.get(category_name) if self._tree is not None else None
+        if entry is None:
+            return f"Category '{category_name}' not found in database."
+        if entry[0] is None:
+            return f"No standard found for category '{category_name}'."
+        return f"Subcategory '{subcategory_name}' not found for category '{category_name}'."
 
 
+namespace_cache = NamespaceCache()
 
+
+def generate_namespace(category_name: str, subcategory_name: str, metric_short_key: str) -> str:
+    triple = (category_name, subcategory_name, metric_short_key)
+    namespace = namespace_cache.resolve_many([triple]).get(triple)
+    if namespace is None:
+        raise ValueError(namespace_cache.explain(category_name, subcategory_name))
+    return namespace
@@ -10,7 +10,7 @@ from project_services.influx_service import write_mapped_metrics
 from sql_services.insert_file_upload_log import insert_file_upload_log
 from sql_services.insert_metric_definition import insert_metric_definition
 from sql_services.insert_datacenter import insert_datacenter
-from ingestion_controller.automated_mapper import process_new_raw_metric
+from ingestion_controller.automated_mapper import process_new_raw_metrics
 
 st.title("📁 Unified Metric Ingestion")
 
@@ -33,11 +33,11 @@ if uploaded_file and datacenter:
         raw_metrics, mapped_metrics = parse_and_extract_file_metrics(temp_path, datacenter)
 
         st.write(f"🔍 Raw metrics detected: {list(raw_metrics.keys())}")
+        st.write(f"🚀 Classifying + mapping {len(raw_metrics)} raw metrics")
+        unified_keys = process_new_raw_metrics(list(raw_metrics))
         new_mapped_metrics = {}
         for raw_key, value in raw_metrics.items():
-            st.write(f"🚀 Classifying + mapping: {raw_key}")
-            unified_key = process_new_raw_metric(raw_key)
-            new_mapped_metrics[unified_key] = value
+            new_mapped_metrics[unified_keys[raw_key]] = value
 
         timestamp = datetime.utcnow()
         st.write("📈 Storing metrics in InfluxDB...")
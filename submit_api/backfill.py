@@ -0,0 +1,168 @@
+# backfill.py
+# Purpose: parallel re-export of the whole metrics history into Postgres
+# (what export_full does, but split over several worker processes).
+#
+# Usage:
+#   python backfill.py [--workers 4] [--partitions 16] [--job full] [--publisher EMAIL] [--reset]
+#
+# - The _id range is split into --partitions ranges of equal ObjectId creation time.
+# - Each partition is exported by a worker process with its own Mongo cursor and
+#   Postgres connection, committing every EXPORT_CHUNK_DOCS documents.
+# - The plan and per-partition progress are checkpointed in the cursors
+#   collection ("backfill:<job>"): running the same job again skips finished
+#   partitions and resumes the others after their last committed _id.
+#   --reset discards the checkpoints and starts over.
+# - Rows are inserted with ON CONFLICT DO NOTHING, so overlapping with the live
+#   exporter is harmless. The incremental watermark is not touched.
+
+import argparse
+import multiprocessing
+import os
+import re
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+from psycopg2 import connect
+from pymongo import ASCENDING, DESCENDING, MongoClient
+
+import mongodb_to_sql as xport
+from metrics_reader import COLLECTION_NAME, CURSORS_COLLECTION, DB_NAME, MONGO_URI, _to_dict
+
+
+def _checkpoint_name(job: str, index: Optional[int] = None) -> str:
+    return f"backfill:{job}" if index is None else f"backfill:{job}:{index}"
+
+
+def plan_partitions(col, n: int, query: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Split [min _id, max _id] into `n` ranges of equal creation-time span.
+    Each partition is {"index", "lo", "hi"}: lo inclusive, hi exclusive, None = unbounded.
+    """
+    first = col.find_one(query, {"_id": 1}, sort=[("_id", ASCENDING)])
+    last = col.find_one(query, {"_id": 1}, sort=[("_id", DESCENDING)])
+    if first is None:
+        return []
+    if not isinstance(first["_id"], ObjectId) or not isinstance(last["_id"], ObjectId):
+        raise SystemExit("backfill partitions by ObjectId creation time; this collection has other _id types")
+    start = first["_id"].generation_time.timestamp()
+    span = last["_id"].generation_time.timestamp() + 1 - start
+    bounds = [None] + [
+        ObjectId.from_datetime(datetime.fromtimestamp(start + span * i / n, tz=timezone.utc))
+        for i in range(1, n)
+    ] + [None]
+    return [{"index": i, "lo": bounds[i], "hi": bounds[i + 1]} for i in range(n)]
+
+
+def export_partition(job: str, part: Dict[str, Any], query: Dict[str, Any], chunk_size: int) -> Dict[str, Any]:
+    """Worker: export one partition, checkpointing after every committed chunk."""
+    client = MongoClient(MONGO_URI, tz_aware=True)
+    db = client[DB_NAME]
+    col, cursors = db[COLLECTION_NAME], db[CURSORS_COLLECTION]
+    name = _checkpoint_name(job, part["index"])
+    state = cursors.find_one({"name": name}) or {}
+    if state.get("done"):
+        client.close()
+        return state
+
+    id_range: Dict[str, Any] = {}
+    if state.get("last_id") is not None:
+        id_range["$gt"] = state["last_id"]
+    elif part["lo"] is not None:
+        id_range["$gte"] = part["lo"]
+    if part["hi"] is not None:
+        id_range["$lt"] = part["hi"]
+    q = dict(query)
+    if id_range:
+        q["_id"] = id_range
+
+    docs_done, rows_done = state.get("docs", 0), state.get("rows", 0)
+    started = time.monotonic()
+    try:
+        with connect(xport.PG_DSN) as conn, conn.cursor() as cur:
+            chunk: List[Dict[str, Any]] = []
+            cursor = col.find(q).sort("_id", ASCENDING).batch_size(chunk_size)
+            for doc in cursor:
+                chunk.append(doc)
+                if len(chunk) >= chunk_size:
+                    docs_done, rows_done = _commit_chunk(conn, cur, cursors, name, chunk, docs_done, rows_done)
+                    chunk = []
+            if chunk:
+                docs_done, rows_done = _commit_chunk(conn, cur, cursors, name, chunk, docs_done, rows_done)
+        cursors.update_one({"name": name}, {"$set": {"done": True}}, upsert=True)
+    finally:
+        client.close()
+    print(f"  partition {part['index']}: {docs_done} docs, {rows_done} rows ({time.monotonic() - started:.1f}s)")
+    return {"index": part["index"], "docs": docs_done, "rows": rows_done, "done": True}
+
+
+def _commit_chunk(conn, cur, cursors, name: str, chunk, docs_done: int, rows_done: int):
+    last_id = chunk[-1]["_id"]
+    rows_done += xport.write_docs(cur, (_to_dict(d) for d in chunk))
+    conn.commit()
+    docs_done += len(chunk)
+    cursors.update_one(
+        {"name": name},
+        {"$set": {"last_id": last_id, "docs": docs_done, "rows": rows_done,
+                  "updated_at": datetime.now(timezone.utc).isoformat()}},
+        upsert=True,
+    )
+    return docs_done, rows_done
+
+
+def _run_partition(args):
+    return export_partition(*args)
+
+
+def backfill(workers: int, partitions: int, job: str, publisher_email: Optional[str] = None,
+             reset: bool = False, chunk_size: int = xport.EXPORT_CHUNK_DOCS) -> int:
+    client = MongoClient(MONGO_URI, tz_aware=True)
+    db = client[DB_NAME]
+    cursors = db[CURSORS_COLLECTION]
+    plan_name = _checkpoint_name(job)
+    if reset:
+        cursors.delete_many({"name": {"$regex": f"^{re.escape(plan_name)}(:|$)"}})
+
+    query = {"publisher_email": publisher_email} if publisher_email else {}
+    plan = cursors.find_one({"name": plan_name})
+    if plan is None:
+        # The plan is fixed on the first run so a resumed job keeps the same ranges
+        parts = plan_partitions(db[COLLECTION_NAME], partitions, query)
+        cursors.update_one(
+            {"name": plan_name},
+            {"$set": {"partitions": parts, "query": query,
+                      "created_at": datetime.now(timezone.utc).isoformat()}},
+            upsert=True,
+        )
+    elif plan.get("query") != query:
+        raise SystemExit(f"Job '{job}' was planned with a different filter; use --reset or another --job")
+    else:
+        parts = plan["partitions"]
+    client.close()
+    if not parts:
+        print("Nothing to export.")
+        return 0
+
+    xport.ensure_schema()
+    print(f"Backfill '{job}': {len(parts)} partitions on {workers} workers")
+    # spawn: each worker opens its own Mongo and Postgres connections, none are inherited
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(processes=workers) as pool:
+        results = pool.map(_run_partition, [(job, p, query, chunk_size) for p in parts], chunksize=1)
+    rows = sum(r.get("rows", 0) for r in results)
+    print(f"Done: {sum(r.get('docs', 0) for r in results)} docs, {rows} rows")
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parallel, resumable re-export of all metrics into Postgres.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--partitions", type=int, default=None, help="default: 4 per worker")
+    parser.add_argument("--job", default="full", help="checkpoint name; reuse it to resume")
+    parser.add_argument("--publisher", default=None, help="only export this publisher's metrics")
+    parser.add_argument("--chunk-size", type=int, default=xport.EXPORT_CHUNK_DOCS)
+    parser.add_argument("--reset", action="store_true", help="discard the job's checkpoints and start over")
+    args = parser.parse_args()
+    backfill(args.workers, args.partitions or args.workers * 4, args.job, args.publisher,
+             args.reset, args.chunk_size)
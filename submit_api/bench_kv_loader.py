@@ -0,0 +1,70 @@
+# bench_kv_loader.py
+# Benchmark: rows/sec of the metrics_kv loaders in mongodb_to_sql.
+#   values        execute_values(page_size=1000), the original path
+#   copy/text     COPY into a staging table (text format) + INSERT ... SELECT
+#   copy/binary   same with the binary COPY format
+# Each run loads fresh synthetic metrics (source_oid prefixed "bench-") and
+# deletes them afterwards. Use a scratch database.
+#
+# Usage: PG_DSN=postgresql://... python bench_kv_loader.py [--docs 20000] [--keys 20]
+
+import argparse
+import random
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from psycopg2 import connect
+
+import mongodb_to_sql as m2s
+
+
+def make_docs(n_docs: int, n_keys: int):
+    rnd = random.Random(7)
+    run = uuid.uuid4().hex[:8]
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    for i in range(n_docs):
+        body = {f"metric_{k}": round(rnd.uniform(0, 1000), 3) for k in range(n_keys - 2)}
+        body["labels"] = {"node": f"node-{i % 50}", "site": "uva-lab"}
+        yield {
+            "_id": f"bench-{run}-{i}",
+            "publisher_email": "bench@example.org",
+            "timestamp": (start + timedelta(seconds=i)).isoformat(),
+            "body": body,
+        }
+
+
+def run(mode: str, fmt: str, n_docs: int, n_keys: int) -> float:
+    rows = [r for d in make_docs(n_docs, n_keys) for r in m2s.rows_from_metric(d)]
+    with connect(m2s.PG_DSN) as conn, conn.cursor() as cur:
+        start = time.perf_counter()
+        if mode == "copy":
+            m2s._copy_merge(cur, rows, fmt=fmt)
+        else:
+            m2s._write_rows(cur, rows, mode=mode)
+        conn.commit()
+        elapsed = time.perf_counter() - start
+        cur.execute("DELETE FROM public.metrics_kv WHERE source_oid LIKE 'bench-%%'")
+        conn.commit()
+    return len(rows) / elapsed
+
+
+def main(n_docs: int, n_keys: int, repeat: int) -> None:
+    m2s.ensure_schema()
+    print(f"{n_docs} docs x {n_keys} keys = {n_docs * n_keys} rows per load")
+    print(f"{'loader':>12} {'rows/s':>12} {'vs values':>9}")
+    base = None
+    for mode, fmt in (("values", None), ("copy", "text"), ("copy", "binary")):
+        best = max(run(mode, fmt, n_docs, n_keys) for _ in range(repeat))
+        base = base or best
+        label = mode if fmt is None else f"{mode}/{fmt}"
+        print(f"{label:>12} {best:>12,.0f} {best / base:>8.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare metrics_kv loaders (execute_values vs COPY).")
+    parser.add_argument("--docs", type=int, default=20000)
+    parser.add_argument("--keys", type=int, default=20, help="KV rows per document")
+    parser.add_argument("--repeat", type=int, default=3, help="best of N runs")
+    args = parser.parse_args()
+    main(args.docs, args.keys, args.repeat)
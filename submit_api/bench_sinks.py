@@ -0,0 +1,151 @@
+# bench_sinks.py
+# Benchmark: metrics_kv (one row per key) vs metrics_wide (one row per document)
+# - loads the same synthetic metrics into both sinks (SINK_MODE=both path)
+# - reports rows, table+index size and load time
+# - times typical Grafana panels on both layouts (median of --repeat runs)
+# Needs an empty scratch database; the benchmark tables are emptied afterwards
+# unless --keep is given.
+#
+# Usage: PG_DSN=postgresql://... python bench_sinks.py [--docs 50000] [--keys 20]
+
+import argparse
+import random
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+
+from psycopg2 import connect
+
+import mongodb_to_sql as xport
+import wide_sink
+
+PUBLISHER = "bench@example.org"
+NODES = 50
+
+
+def make_docs(n_docs: int, n_keys: int):
+    rnd = random.Random(16)
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    for i in range(n_docs):
+        body = {f"metric_{k}": round(rnd.uniform(0, 1000), 3) for k in range(n_keys)}
+        body["labels"] = {"node": f"node-{i % NODES}", "site": "uva-lab"}
+        if i % 100 == 0:
+            body["note"] = "rare key, stays in extra"
+        yield {
+            "_id": f"bench-{i:012d}",
+            "publisher_email": PUBLISHER,
+            "timestamp": (start + timedelta(seconds=30 * i)).isoformat(),
+            "body": body,
+        }
+
+
+def panels(columns):
+    m0, m1, m2 = (columns[f"metric_{k}"][0] for k in range(3))
+    node = columns["labels.node"][0]
+    return {
+        "1 metric, hourly avg": (
+            """SELECT date_trunc('hour', ts), avg(value_numeric) FROM public.metrics_kv
+               WHERE publisher_email = %(p)s AND key = 'metric_0' GROUP BY 1 ORDER BY 1""",
+            f"""SELECT date_trunc('hour', ts), avg("{m0}") FROM public.metrics_wide
+               WHERE publisher_email = %(p)s GROUP BY 1 ORDER BY 1""",
+        ),
+        "3 metrics, 1 node": (
+            """SELECT date_trunc('hour', v.ts),
+                      avg(v.value_numeric) FILTER (WHERE v.key = 'metric_0'),
+                      avg(v.value_numeric) FILTER (WHERE v.key = 'metric_1'),
+                      avg(v.value_numeric) FILTER (WHERE v.key = 'metric_2')
+               FROM public.metrics_kv v
+               JOIN public.metrics_kv n ON n.source_oid = v.source_oid AND n.key = 'labels.node'
+               WHERE v.publisher_email = %(p)s AND v.key IN ('metric_0', 'metric_1', 'metric_2')
+                 AND n.value_text = %(node)s
+               GROUP BY 1 ORDER BY 1""",
+            f"""SELECT date_trunc('hour', ts), avg("{m0}"), avg("{m1}"), avg("{m2}")
+               FROM public.metrics_wide
+               WHERE publisher_email = %(p)s AND "{node}" = %(node)s
+               GROUP BY 1 ORDER BY 1""",
+        ),
+        "latest per node": (
+            """SELECT DISTINCT ON (n.value_text) n.value_text, v.value_numeric
+               FROM public.metrics_kv v
+               JOIN public.metrics_kv n ON n.source_oid = v.source_oid AND n.key = 'labels.node'
+               WHERE v.publisher_email = %(p)s AND v.key = 'metric_0'
+               ORDER BY n.value_text, v.ts DESC""",
+            f"""SELECT DISTINCT ON ("{node}") "{node}", "{m0}" FROM public.metrics_wide
+               WHERE publisher_email = %(p)s
+               ORDER BY "{node}", ts DESC""",
+        ),
+    }
+
+
+def vacuum_analyze(*tables: str) -> None:
+    # VACUUM cannot run in a transaction, and `with conn` always opens one
+    conn = connect(xport.PG_DSN)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            for table in tables:
+                cur.execute(f"VACUUM ANALYZE {table}")
+    finally:
+        conn.close()
+
+
+def median_ms(cur, query: str, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cur.execute(query, {"p": PUBLISHER, "node": "node-7"})
+        cur.fetchall()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def main(n_docs: int, n_keys: int, repeat: int, keep: bool) -> None:
+    xport.SINK_MODE = "both"
+    xport.ensure_schema()
+    with connect(xport.PG_DSN) as conn, conn.cursor() as cur:
+        cur.execute("SELECT (SELECT count(*) FROM public.metrics_kv) + (SELECT count(*) FROM public.metrics_wide)")
+        if cur.fetchone()[0]:
+            raise SystemExit("metrics_kv/metrics_wide are not empty: run this against a scratch database")
+
+        timings = {"kv": 0.0, "wide": 0.0}
+        chunk = []
+        for doc in make_docs(n_docs, n_keys):
+            chunk.append(doc)
+            if len(chunk) == xport.EXPORT_CHUNK_DOCS or doc["_id"].endswith(f"{n_docs - 1:012d}"):
+                for sink in ("kv", "wide"):
+                    start = time.perf_counter()
+                    xport.write_docs(cur, chunk, sink=sink)
+                    conn.commit()
+                    timings[sink] += time.perf_counter() - start
+                chunk = []
+        # Docs of the first chunks were written before their keys were promoted
+        conn.commit()
+        wide_sink.backfill_columns(conn)
+        vacuum_analyze("public.metrics_kv", "public.metrics_wide")
+
+        print(f"{n_docs} docs x {n_keys + 2} keys")
+        print(f"{'sink':>6} {'rows':>10} {'size MB':>9} {'load s':>8}")
+        for sink, table in (("kv", "metrics_kv"), ("wide", "metrics_wide")):
+            cur.execute(f"SELECT count(*), pg_total_relation_size('public.{table}') FROM public.{table}")
+            rows, size = cur.fetchone()
+            print(f"{sink:>6} {rows:>10,} {size / 1e6:>9.1f} {timings[sink]:>8.2f}")
+
+        columns = wide_sink.load_columns(cur)
+        print(f"\n{'panel':>22} {'kv ms':>9} {'wide ms':>9} {'speedup':>8}")
+        for name, (kv_sql, wide_sql) in panels(columns).items():
+            kv_ms, wide_ms = median_ms(cur, kv_sql, repeat), median_ms(cur, wide_sql, repeat)
+            print(f"{name:>22} {kv_ms:>9.1f} {wide_ms:>9.1f} {kv_ms / wide_ms:>7.1f}x")
+
+        if not keep:
+            cur.execute("TRUNCATE public.metrics_kv, public.metrics_wide")
+            conn.commit()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the metrics_kv and metrics_wide Postgres sinks.")
+    parser.add_argument("--docs", type=int, default=50000)
+    parser.add_argument("--keys", type=int, default=20, help="numeric metrics per document")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--keep", action="store_true", help="keep the loaded rows")
+    args = parser.parse_args()
+    main(args.docs, args.keys, args.repeat, args.keep)
@@ -0,0 +1,84 @@
+# bench_submit_parse.py
+# Microbenchmark: parse (+ validate) throughput of /submit payloads.
+#   stdlib          json.loads, no validation (the previous request.json() path)
+#   orjson          payload_validation.loads fast path
+#   orjson+schema   fast path + precompiled (fastjsonschema) publisher schema
+#   stdlib+jsonschema  json.loads + uncompiled jsonschema.validate, for reference
+#
+# Usage: python bench_submit_parse.py [--seconds 1.0]
+
+import argparse
+import json
+import random
+import time
+
+import fastjsonschema
+
+import payload_validation
+
+SCHEMA = {
+    "type": "object",
+    "required": ["cpu_watts", "mem_bytes", "labels"],
+    "properties": {
+        "cpu_watts": {"type": "number", "minimum": 0},
+        "mem_bytes": {"type": "integer", "minimum": 0},
+        "labels": {
+            "type": "object",
+            "properties": {"node": {"type": "string"}, "job_id": {"type": "string"}},
+            "additionalProperties": {"type": "string"},
+        },
+        "samples": {"type": "array", "items": {"type": "number"}},
+    },
+}
+
+
+def make_payload(n_samples: int) -> bytes:
+    rnd = random.Random(42)
+    return json.dumps({
+        "cpu_watts": round(rnd.uniform(5, 300), 2),
+        "mem_bytes": rnd.randint(1 << 20, 1 << 34),
+        "labels": {"node": "compute-0", "job_id": "abc123", "site": "uva-lab"},
+        "samples": [round(rnd.random() * 100, 3) for _ in range(n_samples)],
+    }).encode()
+
+
+def run(fn, raw: bytes, seconds: float) -> float:
+    n = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while time.perf_counter() < deadline:
+        for _ in range(100):
+            fn(raw)
+        n += 100
+    return n / (time.perf_counter() - start)
+
+
+def main(seconds: float) -> None:
+    validate = fastjsonschema.compile(SCHEMA)
+    paths = {
+        "stdlib": json.loads,
+        "orjson": payload_validation.loads,
+        "orjson+schema": lambda raw: validate(payload_validation.loads(raw)),
+    }
+    try:
+        import jsonschema
+        paths["stdlib+jsonschema"] = lambda raw: jsonschema.validate(json.loads(raw), SCHEMA)
+    except ImportError:
+        pass
+    if payload_validation.orjson is None:
+        print("note: orjson is not installed, 'orjson' rows use the stdlib fallback")
+
+    print(f"{'payload':>14} {'path':>18} {'ops/s':>12} {'MB/s':>8} {'vs stdlib':>9}")
+    for label, n_samples in (("small", 0), ("1 KB samples", 120), ("16 KB samples", 2000)):
+        raw = make_payload(n_samples)
+        base = None
+        for name, fn in paths.items():
+            ops = run(fn, raw, seconds)
+            base = base or ops
+            print(f"{label:>14} {name:>18} {ops:>12,.0f} {ops * len(raw) / 1e6:>8.1f} {ops / base:>8.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parse + validate throughput of /submit payloads.")
+    parser.add_argument("--seconds", type=float, default=1.0, help="time per measurement")
+    main(parser.parse_args().seconds)
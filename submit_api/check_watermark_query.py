@@ -0,0 +1,145 @@
+# check_watermark_query.py
+# Harness: the exporter watermark query (metrics_reader._since_query) must page
+# through a collection without re-reading or skipping documents, even when many
+# documents share a timestamp and _id order disagrees with timestamp order.
+# The previous predicate ($or: [{timestamp > ts}, {_id > id}]) is run alongside
+# for comparison.
+#
+# Usage:
+#   python check_watermark_query.py                          # mongomock stand-in
+#   python check_watermark_query.py --mongo-uri mongodb://localhost:27017/
+#       (throwaway database on a real mongod; additionally checks with explain()
+#        that the query is one IXSCAN on ix_timestamp_id, with no COLLSCAN or SORT)
+#
+# Exits non-zero when a check fails.
+
+import argparse
+import random
+import sys
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pymongo
+from bson import ObjectId
+
+SORT = [("timestamp", 1), ("_id", 1)]
+
+
+def make_docs(n: int, ties: int, skew: float):
+    """n docs, `ties` per timestamp; a `skew` fraction get _ids out of timestamp order."""
+    rnd = random.Random(15)
+    base = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    ids = [ObjectId.from_datetime(base + timedelta(seconds=i // ties)) for i in range(n)]
+    ids = [ObjectId(oid.binary[:4] + i.to_bytes(8, "big")) for i, oid in enumerate(ids)]
+    for i in rnd.sample(range(n), int(n * skew)):
+        j = rnd.randrange(n)
+        ids[i], ids[j] = ids[j], ids[i]
+    return [
+        {"_id": ids[i], "publisher_email": "check@example.org",
+         "timestamp": (base + timedelta(seconds=i // ties)).isoformat(), "body": {"i": i}}
+        for i in range(n)
+    ]
+
+
+def legacy_query(since_ts, since_id):
+    clauses = []
+    if since_ts:
+        clauses.append({"timestamp": {"$gt": since_ts}})
+    if since_id:
+        clauses.append({"_id": {"$gt": ObjectId(since_id)}})
+    return {"$or": clauses} if clauses else {}
+
+
+def page_through(col, query_fn, page_size: int, max_pages: int):
+    """Follow the watermark like export_incremental does; returns the _ids read, in order."""
+    seen, since_ts, since_id = [], None, None
+    for _ in range(max_pages):
+        docs = list(col.find(query_fn(since_ts, since_id)).sort(SORT).limit(page_size))
+        if not docs:
+            return seen, True
+        seen.extend(d["_id"] for d in docs)
+        since_ts, since_id = docs[-1]["timestamp"], str(docs[-1]["_id"])
+    return seen, False  # never caught up
+
+
+def report(name: str, seen, finished: bool, expected) -> bool:
+    reread = len(seen) - len(set(seen))
+    missed = len(set(expected) - set(seen))
+    print(f"{name:>8}: read {len(seen)} docs for {len(expected)}, re-reads {reread}, missed {missed}"
+          + ("" if finished else ", did not finish"))
+    return finished and reread == 0 and missed == 0
+
+
+def plan_stages(plan):
+    yield plan
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from plan_stages(child)
+
+
+def check_plan(db, col, since_query) -> bool:
+    docs = list(col.find().sort(SORT).skip(col.estimated_document_count() // 2).limit(1))
+    q = since_query(docs[0]["timestamp"], str(docs[0]["_id"]), None)
+    explain = db.command(
+        "explain",
+        {"find": col.name, "filter": q, "sort": dict(SORT), "limit": 1000},
+        verbosity="executionStats",
+    )
+    stages = list(plan_stages(explain["queryPlanner"]["winningPlan"]))
+    names = [s.get("stage") for s in stages]
+    indexes = {s.get("indexName") for s in stages if s.get("stage") == "IXSCAN"}
+    stats = explain["executionStats"]
+    print(f"    plan: {' <- '.join(names)}; indexes {sorted(indexes)}; "
+          f"keys examined {stats['totalKeysExamined']}, docs examined {stats['totalDocsExamined']}, "
+          f"returned {stats['nReturned']}")
+    return "COLLSCAN" not in names and "SORT" not in names and indexes == {"ix_timestamp_id"}
+
+
+def main(mongo_uri, n: int, ties: int, skew: float, page_size: int) -> int:
+    if mongo_uri is None:
+        try:
+            import mongomock
+        except ImportError:
+            print("mongomock is not installed; pass --mongo-uri to use a real mongod")
+            return 2
+        # metrics_reader connects at import time
+        pymongo.MongoClient = mongomock.MongoClient
+        client = mongomock.MongoClient()
+    else:
+        client = pymongo.MongoClient(mongo_uri)
+    from metrics_reader import _since_query
+
+    db_name = f"watermark_check_{uuid.uuid4().hex[:8]}"
+    db = client[db_name]
+    col = db["metrics"]
+    ok = True
+    try:
+        col.create_index([("timestamp", 1), ("_id", 1)], name="ix_timestamp_id")
+        docs = make_docs(n, ties, skew)
+        col.insert_many(docs)
+        expected = [d["_id"] for d in docs]
+        print(f"{n} docs, {ties} per timestamp, {skew:.0%} with out-of-order _id; pages of {page_size}")
+        max_pages = 4 * n // page_size + 10
+        ok &= report("keyset", *page_through(col, lambda t, i: _since_query(t, i, None), page_size, max_pages), expected)
+        report("legacy", *page_through(col, legacy_query, page_size, max_pages), expected)
+        if mongo_uri is not None:
+            ok &= check_plan(db, col, _since_query)
+        else:
+            print("    (explain() needs a real mongod: pass --mongo-uri to check the query plan)")
+    finally:
+        client.drop_database(db_name)
+    print("OK" if ok else "FAILED")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the exporter watermark query for re-reads, misses and its plan.")
+    parser.add_argument("--mongo-uri", default=None, help="real mongod to use instead of mongomock")
+    parser.add_argument("--docs", type=int, default=5000)
+    parser.add_argument("--ties", type=int, default=25, help="documents per timestamp")
+    parser.add_argument("--skew", type=float, default=0.05, help="fraction of _ids out of timestamp order")
+    parser.add_argument("--page-size", type=int, default=100)
+    args = parser.parse_args()
+    sys.exit(main(args.mongo_uri, args.docs, args.ties, args.skew, args.page_size))
@@ -0,0 +1,235 @@
+# compression.py
+# Purpose: ASGI middleware for compressed traffic on the metrics API.
+# - Requests with `Content-Encoding: gzip|zstd` are decompressed while they are
+#   received, with a cap on the decoded size (decompression bombs -> 413).
+# - Responses are compressed with the best encoding offered in `Accept-Encoding`
+#   (zstd, then gzip). Streaming responses are flushed chunk by chunk.
+# - Byte counters per encoding show the bandwidth saved (see snapshot()).
+
+import os
+import zlib
+from typing import Any, Dict, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.exceptions import HTTPException
+
+try:
+    import zstandard
+except ImportError:  # zstd support is optional
+    zstandard = None
+
+MAX_DECODED_BODY_BYTES = int(os.getenv("MAX_DECODED_BODY_BYTES", str(16 * 1024 * 1024)))
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+ZSTD_LEVEL = int(os.getenv("ZSTD_LEVEL", "3"))
+
+# Already compressed (or binary) payloads are not worth compressing again
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+
+
+def supported_encodings():
+    return ("zstd", "gzip") if zstandard is not None else ("gzip",)
+
+
+# Process-wide byte counters per encoding (Starlette builds middleware lazily,
+# so they live at module level rather than on the middleware instance)
+counters: Dict[str, Dict[str, int]] = {
+    enc: {"request_wire_bytes": 0, "request_decoded_bytes": 0,
+          "response_raw_bytes": 0, "response_wire_bytes": 0}
+    for enc in ("gzip", "zstd")
+}
+
+
+def snapshot() -> Dict[str, Dict[str, int]]:
+    out = {}
+    for enc, c in counters.items():
+        out[enc] = {
+            **c,
+            "request_bytes_saved": c["request_decoded_bytes"] - c["request_wire_bytes"],
+            "response_bytes_saved": c["response_raw_bytes"] - c["response_wire_bytes"],
+        }
+    return out
+
+
+class _BoundedSink:
+    """Write target for zstandard's stream_writer that stops once `limit` is passed."""
+
+    def __init__(self):
+        self.limit = 0
+        self.buf = bytearray()
+
+    def write(self, data: bytes) -> int:
+        self.buf += data
+        if len(self.buf) > self.limit:
+            raise OverflowError("decoded body too large")
+        return len(data)
+
+
+class _Decoder:
+    def __init__(self, encoding: str):
+        self._gzip = encoding == "gzip"
+        if self._gzip:
+            # 16 + MAX_WBITS: expect a gzip header/trailer
+            self._obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            self._sink = _BoundedSink()
+            self._obj = zstandard.ZstdDecompressor().stream_writer(self._sink, write_size=65536)
+
+    def decode(self, data: bytes, max_length: int) -> bytes:
+        """Decode one chunk, never inflating much more than `max_length` (the remaining budget)."""
+        if self._gzip:
+            return self._obj.decompress(data, max_length + 1)
+        self._sink.limit = max_length
+        self._sink.buf = bytearray()
+        try:
+            self._obj.write(data)
+        except OverflowError:
+            pass  # the caller sees len(out) > max_length
+        return bytes(self._sink.buf)
+
+
+class _Encoder:
+    def __init__(self, encoding: str):
+        if encoding == "gzip":
+            self._obj = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            self._sync = zlib.Z_SYNC_FLUSH
+        else:
+            self._obj = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+            self._sync = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+
+    def encode(self, data: bytes, more: bool) -> bytes:
+        out = self._obj.compress(data)
+        # Flush every chunk of a stream so clients see lines as they are produced
+        return out + (self._obj.flush(self._sync) if more else self._obj.flush())
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Best supported encoding in an Accept-Encoding header (q=0 means refused)."""
+    offered: Dict[str, float] = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        offered[name.strip()] = q
+    best = None
+    for enc in supported_encodings():
+        q = offered.get(enc, offered.get("*", 0.0))
+        if q > 0 and (best is None or q > best[1]):
+            best = (enc, q)
+    return best[0] if best else None
+
+
+class CompressionMiddleware:
+    def __init__(self, app, max_decoded_bytes: int = MAX_DECODED_BODY_BYTES,
+                 min_size: int = COMPRESS_MIN_BYTES):
+        self.app = app
+        self.max_decoded_bytes = max_decoded_bytes
+        self.min_size = min_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+
+        encoding = headers.get("content-encoding", "").strip().lower()
+        if encoding and encoding != "identity":
+            if encoding not in supported_encodings():
+                await self._reject(send, 415, f"Unsupported Content-Encoding: {encoding}")
+                return
+            # Downstream sees a plain body of unknown length. The scope is updated in
+            # place so outer middleware still sees what the router adds to it.
+            scope["headers"] = [
+                (k, v) for k, v in scope["headers"]
+                if k not in (b"content-encoding", b"content-length")
+            ]
+            receive = self._decoding_receive(receive, encoding)
+
+        accepted = choose_encoding(headers.get("accept-encoding", ""))
+        if accepted and scope.get("method") != "HEAD":
+            send = self._encoding_send(send, accepted)
+
+        await self.app(scope, receive, send)
+
+    def _decoding_receive(self, receive, encoding: str):
+        decoder = _Decoder(encoding)
+        enc_counters = counters[encoding]
+        decoded_total = 0
+
+        async def wrapped():
+            nonlocal decoded_total
+            message = await receive()
+            if message["type"] != "http.request":
+                return message
+            data = message.get("body", b"")
+            try:
+                out = decoder.decode(data, self.max_decoded_bytes - decoded_total)
+            except Exception as e:  # zlib.error / zstandard.ZstdError on corrupt input
+                raise HTTPException(status_code=400, detail=f"Invalid {encoding} body: {e}")
+            decoded_total += len(out)
+            enc_counters["request_wire_bytes"] += len(data)
+            enc_counters["request_decoded_bytes"] += len(out)
+            if decoded_total > self.max_decoded_bytes:
+                raise HTTPException(status_code=413, detail=f"Decoded body exceeds {self.max_decoded_bytes} bytes")
+            return {**message, "body": out}
+
+        return wrapped
+
+    def _encoding_send(self, send, encoding: str):
+        enc_counters = counters[encoding]
+        state: Dict[str, Any] = {"start": None, "encoder": None, "passthrough": False}
+
+        async def wrapped(message):
+            if message["type"] == "http.response.start":
+                resp_headers = Headers(raw=message.get("headers", []))
+                content_type = resp_headers.get("content-type", "")
+                if (
+                    "content-encoding" in resp_headers
+                    or message["status"] in (204, 304)
+                    or not content_type.startswith(COMPRESSIBLE_TYPES)
+                ):
+                    state["passthrough"] = True
+                    await send(message)
+                else:
+                    # Decide on the first body chunk, once its size is known
+                    state["start"] = message
+                return
+            if message["type"] != "http.response.body" or state["passthrough"]:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more = message.get("more_body", False)
+            if state["start"] is not None:
+                start, state["start"] = state["start"], None
+                if not more and len(body) < self.min_size:
+                    state["passthrough"] = True
+                    await send(start)
+                    await send(message)
+                    return
+                mutable = MutableHeaders(raw=start.setdefault("headers", []))
+                mutable["Content-Encoding"] = encoding
+                mutable.add_vary_header("Accept-Encoding")
+                del mutable["Content-Length"]
+                state["encoder"] = _Encoder(encoding)
+                await send(start)
+
+            out = state["encoder"].encode(body, more)
+            enc_counters["response_raw_bytes"] += len(body)
+            enc_counters["response_wire_bytes"] += len(out)
+            await send({"type": "http.response.body", "body": out, "more_body": more})
+
+        return wrapped
+
+    async def _reject(self, send, status_code: int, detail: str) -> None:
+        body = ('{"detail":"%s"}' % detail.replace('"', "'")).encode()
+        await send({
+            "type": "http.response.start",
+            "status": status_code,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,107 @@
+# exporter_metrics.py
+# Purpose: Prometheus instruments for the Mongo -> Postgres exporter
+# (mongodb_to_sql, watch_db_changes, backfill).
+# - Lag: the watermark's timestamp per processor; its age is computed when the
+#   metrics are collected (scrape or push), so it keeps growing while the
+#   exporter is stuck. cim_exporter_caught_up tells a stuck exporter from a
+#   quiet one.
+# - Throughput: documents and rows per batch, rows inserted vs. skipped by
+#   ON CONFLICT.
+# - Stages: time spent reading from Mongo, flattening, writing and committing
+#   to Postgres, to tell which one to scale.
+# - Retries of the watcher loop, by reason.
+# - Documents skipped, e.g. late data for a partition detached by retention.
+# watch_db_changes serves these on EXPORTER_METRICS_PORT and/or pushes them to
+# PUSHGATEWAY_URL (see serve()).
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram, push_to_gateway, start_http_server
+
+from pg_copy import to_datetime
+
+EXPORTER_METRICS_PORT = int(os.getenv("EXPORTER_METRICS_PORT", "0"))  # 0 disables the endpoint
+PUSHGATEWAY_URL = os.getenv("PUSHGATEWAY_URL")  # e.g. http://pushgateway:9091
+PUSH_INTERVAL_SECONDS = float(os.getenv("PUSH_INTERVAL_SECONDS", "15"))
+
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (1, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000, 500000)
+
+WATERMARK_TIMESTAMP = Gauge(
+    "cim_exporter_watermark_timestamp_seconds", "Timestamp of the last exported document", ["processor"],
+)
+WATERMARK_AGE = Gauge(
+    "cim_exporter_watermark_age_seconds", "Now minus the watermark timestamp (export lag)", ["processor"],
+)
+# The age also grows while no new metrics arrive: alert on age AND NOT caught up
+CAUGHT_UP = Gauge(
+    "cim_exporter_caught_up", "1 when the exporter's last read found nothing left to export", ["processor"],
+)
+BATCH_DOCUMENTS = Histogram(
+    "cim_exporter_batch_documents", "Documents per exported batch", buckets=SIZE_BUCKETS,
+)
+BATCH_ROWS = Histogram(
+    "cim_exporter_batch_rows", "metrics_kv rows per exported batch", buckets=SIZE_BUCKETS,
+)
+ROWS = Counter(
+    "cim_exporter_rows_total", "metrics_kv rows by outcome (inserted, or skipped as already exported)", ["result"],
+)
+STAGE_SECONDS = Histogram(
+    "cim_exporter_stage_duration_seconds", "Time per batch and stage (read, flatten, write, commit)",
+    ["stage"], buckets=STAGE_BUCKETS,
+)
+RETRIES = Counter("cim_exporter_retries_total", "Watcher loop restarts by reason", ["reason"])
+SKIPPED_DOCS = Counter(
+    "cim_exporter_skipped_documents_total", "Documents not exported, by reason (retired_partition, expired)", ["reason"],
+)
+
+_watermarks: Dict[str, float] = {}
+
+
+@contextmanager
+def stage(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(name).observe(time.perf_counter() - start)
+
+
+def observe_batch(docs: int, rows: int, inserted: Optional[int] = None) -> None:
+    BATCH_DOCUMENTS.observe(docs)
+    BATCH_ROWS.observe(rows)
+    if inserted is not None:
+        ROWS.labels("inserted").inc(inserted)
+        ROWS.labels("conflict").inc(rows - inserted)
+
+
+def watermark(processor: str, ts_iso: Optional[str]) -> None:
+    """Record the watermark after it was saved; accepts last_ts_iso as stored in the cursors collection."""
+    if not ts_iso:
+        return
+    ts = to_datetime(ts_iso).timestamp()
+    WATERMARK_TIMESTAMP.labels(processor).set(ts)
+    if processor not in _watermarks:
+        WATERMARK_AGE.labels(processor).set_function(lambda p=processor: time.time() - _watermarks[p])
+    _watermarks[processor] = ts
+
+
+def _push_forever(job: str) -> None:
+    while True:
+        time.sleep(PUSH_INTERVAL_SECONDS)
+        try:
+            push_to_gateway(PUSHGATEWAY_URL, job=job, registry=REGISTRY)
+        except Exception as e:
+            print(f"Pushgateway push failed: {e}")
+
+
+def serve(job: str) -> None:
+    """Expose the metrics on EXPORTER_METRICS_PORT and/or push them to PUSHGATEWAY_URL every PUSH_INTERVAL_SECONDS."""
+    if EXPORTER_METRICS_PORT:
+        start_http_server(EXPORTER_METRICS_PORT)
+    if PUSHGATEWAY_URL:
+        threading.Thread(target=_push_forever, args=(job,), name="pushgateway", daemon=True).start()
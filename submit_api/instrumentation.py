@@ -0,0 +1,122 @@
+# instrumentation.py
+# Purpose: Prometheus/OpenMetrics instruments for the login/submit service,
+# served by login_server at /internal/metrics.
+# Hot-path cost is one histogram observation per timed operation; the stats of
+# the token cache, write buffer and compression middleware are only read when
+# /internal/metrics is scraped.
+
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict
+
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram
+from prometheus_client.core import GaugeMetricFamily
+from pymongo.errors import PyMongoError
+
+# Tuned for API latencies: sub-millisecond cache hits up to multi-second bcrypt/Mongo stalls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "cim_http_request_duration_seconds", "HTTP request latency by route",
+    ["method", "route", "status"], buckets=LATENCY_BUCKETS,
+)
+HTTP_IN_FLIGHT = Gauge("cim_http_requests_in_flight", "HTTP requests currently being served")
+BCRYPT_SECONDS = Histogram(
+    "cim_bcrypt_duration_seconds", "Time spent in bcrypt", ["op"], buckets=LATENCY_BUCKETS,
+)
+JWT_DECODE_SECONDS = Histogram(
+    "cim_jwt_decode_duration_seconds", "Time spent decoding/verifying JWTs (token cache misses)",
+    buckets=LATENCY_BUCKETS,
+)
+MONGO_OP_SECONDS = Histogram(
+    "cim_mongo_operation_duration_seconds", "MongoDB operation latency", ["op"], buckets=LATENCY_BUCKETS,
+)
+MONGO_ERRORS = Counter("cim_mongo_errors_total", "MongoDB operations that raised", ["op"])
+
+
+@contextmanager
+def timed(histogram):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start)
+
+
+@contextmanager
+def mongo_op(op: str):
+    """Time a Mongo call (sync or awaited inside the block) and count its failures."""
+    start = time.perf_counter()
+    try:
+        yield
+    except PyMongoError:
+        MONGO_ERRORS.labels(op).inc()
+        raise
+    finally:
+        MONGO_OP_SECONDS.labels(op).observe(time.perf_counter() - start)
+
+
+class PrometheusMiddleware:
+    """ASGI middleware recording latency per route template (not per raw path) and in-flight requests."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            # The router stores the matched route in the scope
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.labels(
+                scope["method"], getattr(route, "path", "unmatched"), str(status)
+            ).observe(time.perf_counter() - start)
+
+
+class SnapshotCollector:
+    """
+    Exposes a stats dict as gauges, read at scrape time: {"hits": 3} -> cim_<name>_hits 3.
+    Nested dicts become a label: {"gzip": {"bytes": 1}} -> cim_<name>_bytes{<label>="gzip"} 1.
+    Non-numeric values are skipped.
+    """
+
+    def __init__(self, name: str, snapshot: Callable[[], Dict[str, Any]], label: str = "kind"):
+        self.name = name
+        self.snapshot = snapshot
+        self.label = label
+
+    def collect(self):
+        families: Dict[str, GaugeMetricFamily] = {}
+
+        def family(key: str, labels):
+            metric = f"cim_{self.name}_{key}"
+            if metric not in families:
+                families[metric] = GaugeMetricFamily(metric, f"{self.name} {key}", labels=labels)
+            return families[metric]
+
+        for key, value in self.snapshot().items():
+            if isinstance(value, dict):
+                for sub, v in value.items():
+                    if isinstance(v, (int, float)) and not isinstance(v, bool):
+                        family(sub, [self.label]).add_metric([key], v)
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                family(key, []).add_metric([], value)
+        yield from families.values()
+
+
+def register_snapshot(name: str, snapshot: Callable[[], Dict[str, Any]], label: str = "kind") -> None:
+    REGISTRY.register(SnapshotCollector(name, snapshot, label))
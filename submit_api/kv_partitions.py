@@ -0,0 +1,187 @@
+# kv_partitions.py
+# Purpose: partition management for a Postgres table range-partitioned by `ts`
+# (public.metrics_kv with KV_PARTITIONING=day|month, see mongodb_to_sql).
+# - Partitions are named <table>_pYYYYMMDD (day) or <table>_pYYYYMM (month).
+# - maintain() creates KV_PARTITIONS_AHEAD partitions ahead of now and applies
+#   the retention policy; ensure_periods() creates the partitions a batch needs
+#   before it is written (late or backfilled data), without filling the gaps
+#   between them.
+# - Callers run the DDL on its own connection and commit it right away, so the
+#   cached partition list never includes partitions of a rolled back transaction.
+# - Retention: partitions ending more than KV_RETENTION_PERIODS periods ago are
+#   detached (kept as plain tables, to archive or drop by hand) or dropped.
+#   Late data for a period whose partition was detached cannot be loaded
+#   without re-attaching it: such periods are reported as retired, and the
+#   exporter skips their documents instead of failing every batch. Data older
+#   than the retention window is skipped too (expired), so a dropped partition
+#   is not created again by late data only to be dropped at the next run.
+
+import os
+import time
+from datetime import date, datetime, timezone
+from typing import Iterable, List, Optional, Set
+
+from psycopg2 import errors, sql
+
+KV_PARTITIONING = os.getenv("KV_PARTITIONING", "none")  # none | day | month
+KV_PARTITIONS_AHEAD = int(os.getenv("KV_PARTITIONS_AHEAD", "3"))
+KV_RETENTION_PERIODS = int(os.getenv("KV_RETENTION_PERIODS", "0"))  # 0 keeps everything
+KV_RETENTION_ACTION = os.getenv("KV_RETENTION_ACTION", "detach")  # detach | drop
+KV_MAINTENANCE_SECONDS = float(os.getenv("KV_MAINTENANCE_SECONDS", "3600"))
+
+GRANULARITIES = ("day", "month")
+
+
+def period_start(d: date, granularity: str) -> date:
+    return d if granularity == "day" else d.replace(day=1)
+
+
+def next_period(start: date, granularity: str) -> date:
+    if granularity == "day":
+        return date.fromordinal(start.toordinal() + 1)
+    return date(start.year + start.month // 12, start.month % 12 + 1, 1)
+
+
+def shift_periods(start: date, n: int, granularity: str) -> date:
+    """`start` moved by n periods (n may be negative)."""
+    if granularity == "day":
+        return date.fromordinal(start.toordinal() + n)
+    months = start.year * 12 + start.month - 1 + n
+    return date(months // 12, months % 12 + 1, 1)
+
+
+class PartitionManager:
+    def __init__(self, schema: str, table: str, granularity: str = KV_PARTITIONING,
+                 ahead: int = KV_PARTITIONS_AHEAD, retention: int = KV_RETENTION_PERIODS,
+                 retention_action: str = KV_RETENTION_ACTION):
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"Unknown partition granularity: {granularity}")
+        if retention_action not in ("detach", "drop"):
+            raise ValueError(f"Unknown retention action: {retention_action}")
+        self.schema = schema
+        self.table = table
+        self.granularity = granularity
+        self.ahead = ahead
+        self.retention = retention
+        self.retention_action = retention_action
+        self._known: Optional[Set[date]] = None
+        self.retired: Set[date] = set()  # periods whose partition exists but is detached
+        self._maintained_at = 0.0
+
+    def _suffix(self, start: date) -> str:
+        return start.strftime("%Y%m%d" if self.granularity == "day" else "%Y%m")
+
+    def _parse(self, name: str) -> Optional[date]:
+        prefix = f"{self.table}_p"
+        if not name.startswith(prefix):
+            return None
+        try:
+            fmt = "%Y%m%d" if self.granularity == "day" else "%Y%m"
+            return datetime.strptime(name[len(prefix):], fmt).date()
+        except ValueError:
+            return None
+
+    def partitions(self, cur) -> Set[date]:
+        """Start dates of the attached partitions (cached per process)."""
+        if self._known is None:
+            cur.execute(
+                """
+                SELECT c.relname FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = to_regclass(%s)
+                """,
+                (f"{self.schema}.{self.table}",),
+            )
+            self._known = {d for (name,) in cur.fetchall() if (d := self._parse(name)) is not None}
+        return self._known
+
+    def period_of(self, ts: datetime) -> date:
+        return period_start(ts.astimezone(timezone.utc).date(), self.granularity)
+
+    def oldest_kept(self, now: Optional[datetime] = None) -> Optional[date]:
+        """Start of the oldest period within the retention window (None: everything is kept)."""
+        if self.retention <= 0:
+            return None
+        now = now or datetime.now(timezone.utc)
+        return shift_periods(period_start(now.date(), self.granularity), -self.retention, self.granularity)
+
+    def expired(self, start: date, now: Optional[datetime] = None) -> bool:
+        oldest = self.oldest_kept(now)
+        return oldest is not None and start < oldest
+
+    def missing(self, cur, stamps: Iterable[datetime]) -> List[date]:
+        """
+        Start dates of the partitions that `stamps` fall into and that do not
+        exist yet (retired and expired ones excluded).
+        """
+        known = self.partitions(cur)
+        needed = {self.period_of(ts) for ts in stamps}
+        return sorted(p for p in needed - known - self.retired if not self.expired(p))
+
+    def _create(self, cur, start: date) -> None:
+        end = next_period(start, self.granularity)
+        name = f"{self.table}_p{self._suffix(start)}"
+        cur.execute("SAVEPOINT kv_partition")
+        try:
+            cur.execute(
+                sql.SQL("CREATE TABLE {} PARTITION OF {} FOR VALUES FROM (%s) TO (%s)").format(
+                    sql.Identifier(self.schema, name),
+                    sql.Identifier(self.schema, self.table),
+                ),
+                # Bounds in UTC: a day partition holds one UTC day
+                (datetime(start.year, start.month, start.day, tzinfo=timezone.utc),
+                 datetime(end.year, end.month, end.day, tzinfo=timezone.utc)),
+            )
+            cur.execute("RELEASE SAVEPOINT kv_partition")
+        except (errors.DuplicateTable, errors.UniqueViolation):
+            cur.execute("ROLLBACK TO SAVEPOINT kv_partition")
+            cur.execute(
+                "SELECT 1 FROM pg_inherits WHERE inhrelid = to_regclass(%s) AND inhparent = to_regclass(%s)",
+                (f"{self.schema}.{name}", f"{self.schema}.{self.table}"),
+            )
+            if cur.fetchone() is None:
+                # Detached by retention (or created by hand): leave it alone, callers skip its data
+                print(f"{self.schema}.{name} exists but is not a partition (detached by retention?): "
+                      f"data for {start} is skipped until it is re-attached or dropped")
+                self.retired.add(start)
+                return
+            # else: created concurrently by another exporter process
+        self._known.add(start)
+
+    def ensure_periods(self, cur, starts: Iterable[date]) -> None:
+        known = self.partitions(cur)
+        for start in starts:
+            if start not in known:
+                self._create(cur, start)
+
+    def apply_retention(self, cur, now: datetime) -> List[str]:
+        """Detach or drop partitions past the retention window; returns their names."""
+        oldest_kept = self.oldest_kept(now)
+        if oldest_kept is None:
+            return []
+        removed = []
+        for start in sorted(self.partitions(cur)):
+            if start >= oldest_kept:
+                break
+            child = sql.Identifier(self.schema, f"{self.table}_p{self._suffix(start)}")
+            if self.retention_action == "drop":
+                cur.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(child))
+            else:
+                cur.execute(sql.SQL("ALTER TABLE {} DETACH PARTITION {}").format(
+                    sql.Identifier(self.schema, self.table), child))
+            self._known.discard(start)
+            removed.append(f"{self.table}_p{self._suffix(start)}")
+        return removed
+
+    def maintain(self, cur, now: Optional[datetime] = None) -> List[str]:
+        """Create partitions ahead of `now` and apply retention."""
+        now = now or datetime.now(timezone.utc)
+        current = period_start(now.date(), self.granularity)
+        self.ensure_periods(cur, [shift_periods(current, n, self.granularity) for n in range(self.ahead + 1)])
+        removed = self.apply_retention(cur, now)
+        self._maintained_at = time.monotonic()
+        return removed
+
+    def maintenance_due(self) -> bool:
+        """True every KV_MAINTENANCE_SECONDS, for long-running exporters."""
+        return time.monotonic() - self._maintained_at >= KV_MAINTENANCE_SECONDS
@@ -0,0 +1,184 @@
+# login_guard.py
+# Purpose: keep /login from starving the rest of the API.
+# - bcrypt runs in a small dedicated thread pool (bcrypt releases the GIL), so a
+#   burst of logins cannot occupy the threads that serve /submit. When the pool
+#   and its short queue are full, callers get LoginBusy (-> 503) instead of waiting.
+# - Token-bucket rate limits per email and per client IP, checked before any
+#   hashing happens (-> 429 with Retry-After).
+# - allowed_emails.txt is cached and re-read only when its mtime changes.
+
+import asyncio
+import ipaddress
+import math
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Set, Tuple
+
+LOGIN_HASH_WORKERS = int(os.getenv("LOGIN_HASH_WORKERS", "2"))
+# Hash jobs allowed to wait for a worker before logins are turned away
+LOGIN_HASH_QUEUE = int(os.getenv("LOGIN_HASH_QUEUE", "16"))
+# Sustained attempts per minute and burst size, per email and per client IP
+LOGIN_RATE_EMAIL_PER_MIN = float(os.getenv("LOGIN_RATE_EMAIL_PER_MIN", "5"))
+LOGIN_BURST_EMAIL = int(os.getenv("LOGIN_BURST_EMAIL", "5"))
+LOGIN_RATE_IP_PER_MIN = float(os.getenv("LOGIN_RATE_IP_PER_MIN", "30"))
+LOGIN_BURST_IP = int(os.getenv("LOGIN_BURST_IP", "30"))
+LOGIN_RATE_MAX_KEYS = int(os.getenv("LOGIN_RATE_MAX_KEYS", "100000"))
+# Behind the Nginx proxy, take the client address from X-Forwarded-For. Only the
+# hops appended by our own proxies can be trusted (the client writes the rest):
+# with TRUSTED_PROXY_HOPS proxies in front of the API, it is the entry that many
+# hops from the right
+TRUST_FORWARDED_FOR = os.getenv("TRUST_FORWARDED_FOR", "0").lower() in ("1", "true", "yes")
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "1"))
+ALLOWED_EMAILS_FILE = os.getenv(
+    "ALLOWED_EMAILS_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "allowed_emails.txt"),
+)
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"Too many login attempts, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class LoginBusy(Exception):
+    def __init__(self, retry_after: int = 1):
+        super().__init__("Too many logins in progress, retry shortly")
+        self.retry_after = retry_after
+
+
+class TokenBucketLimiter:
+    """
+    One token bucket per key: `burst` attempts at once, refilled at `per_minute`.
+    - Buckets are kept in LRU order and bounded by `maxsize`, so spraying many
+      keys cannot grow memory without limit (an evicted key starts full again).
+    - Only used from the event loop, hence no lock.
+    """
+
+    def __init__(self, per_minute: float, burst: int, maxsize: int = LOGIN_RATE_MAX_KEYS):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.maxsize = maxsize
+        self.limited = 0
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()  # key -> (tokens, updated_at)
+
+    def acquire(self, key: str) -> Optional[float]:
+        """Take one token; returns None if allowed, else the seconds until one is available."""
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(key, (float(self.burst), now))
+        tokens = min(float(self.burst), tokens + (now - updated) * self.rate)
+        wait = None
+        if tokens >= 1.0:
+            tokens -= 1.0
+        else:
+            self.limited += 1
+            wait = (1.0 - tokens) / self.rate if self.rate > 0 else 60.0
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.maxsize:
+            self._buckets.popitem(last=False)
+        return wait
+
+    def stats(self):
+        return {"keys": len(self._buckets), "limited": self.limited}
+
+
+class PasswordHasher:
+    """bcrypt offloaded to a bounded pool; at most workers + queue jobs are admitted."""
+
+    def __init__(self, workers: int = LOGIN_HASH_WORKERS, queue: int = LOGIN_HASH_QUEUE):
+        self.workers = workers
+        self.capacity = workers + queue
+        self.in_flight = 0
+        self.rejected = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+
+    async def run(self, fn: Callable, *args):
+        if self.in_flight >= self.capacity:
+            self.rejected += 1
+            raise LoginBusy()
+        self.in_flight += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self.in_flight -= 1
+
+    def stats(self):
+        return {"workers": self.workers, "capacity": self.capacity,
+                "in_flight": self.in_flight, "rejected": self.rejected}
+
+
+class AllowedEmails:
+    """Lower-cased contents of allowed_emails.txt, re-read only when the file changes."""
+
+    def __init__(self, path: str = ALLOWED_EMAILS_FILE):
+        self.path = path
+        self._mtime: Optional[float] = None
+        self._emails: Set[str] = set()
+
+    def get(self) -> Set[str]:
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            self._mtime, self._emails = None, set()
+            return self._emails
+        if mtime != self._mtime:
+            with open(self.path, "r") as f:
+                self._emails = set(line.strip().lower() for line in f if line.strip())
+            self._mtime = mtime
+        return self._emails
+
+
+email_limiter = TokenBucketLimiter(LOGIN_RATE_EMAIL_PER_MIN, LOGIN_BURST_EMAIL)
+ip_limiter = TokenBucketLimiter(LOGIN_RATE_IP_PER_MIN, LOGIN_BURST_IP)
+hasher = PasswordHasher()
+allowed_emails = AllowedEmails()
+
+
+_proxy_warned = False
+
+
+def _warn_untrusted_proxy(peer: str) -> None:
+    """Once: a forwarded request from a local peer while TRUST_FORWARDED_FOR is off."""
+    global _proxy_warned
+    try:
+        local = ipaddress.ip_address(peer)
+    except ValueError:
+        return
+    if local.is_loopback or local.is_private:
+        _proxy_warned = True
+        print(f"⚠️ Requests come through a proxy ({peer}) but TRUST_FORWARDED_FOR is off: "
+              f"all clients share one login rate limit bucket")
+
+
+def client_ip(request) -> str:
+    forwarded = request.headers.get("x-forwarded-for")
+    peer = request.client.host if request.client else "unknown"
+    if TRUST_FORWARDED_FOR:
+        hops = [h.strip() for h in forwarded.split(",")] if forwarded else []
+        if 0 < TRUSTED_PROXY_HOPS <= len(hops) and hops[-TRUSTED_PROXY_HOPS]:
+            return hops[-TRUSTED_PROXY_HOPS]
+    elif forwarded and not _proxy_warned:
+        _warn_untrusted_proxy(peer)
+    return peer
+
+
+def check_login_rate(email: str, ip: str) -> None:
+    """
+    Raise RateLimited when either the IP's or the email's bucket is empty.
+    The IP is checked first: an attempt it rejects takes no token from the
+    email, so a flood from one address cannot lock the account's owner out.
+    """
+    for limiter, key in ((ip_limiter, ip), (email_limiter, email)):
+        wait = limiter.acquire(key)
+        if wait is not None:
+            raise RateLimited(max(1, math.ceil(wait)))
+
+
+def snapshot():
+    return {
+        "hasher": hasher.stats(),
+        "email_limiter": email_limiter.stats(),
+        "ip_limiter": ip_limiter.stats(),
+    }
@@ -1,6 +1,7 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Request, Body
+from fastapi import FastAPI, Depends, HTTPException, status, Request, Query, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials, OAuth2PasswordRequestForm
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import Any
 from passlib.context import CryptContext
@@ -8,10 +9,25 @@ from jose import JWTError, jwt
 from typing import Optional
 import time
 import os
+import json
+from datetime import datetime
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-from metrics_store import store_metric, _col
+from metrics_store import astore_metric, astore_metrics_batch, afind_metrics, aiter_metrics, aensure_indexes, aclose, ts_to_iso
+from metrics_buffer import BufferFull, BufferUnavailable, METRICS_INGEST_MODE, write_buffer
+from token_cache import token_cache
+from login_guard import (
+    LoginBusy, RateLimited, allowed_emails, check_login_rate, client_ip, hasher,
+    snapshot as login_guard_snapshot,
+)
+from compression import CompressionMiddleware, snapshot as compression_snapshot
+from instrumentation import (
+    BCRYPT_SECONDS, JWT_DECODE_SECONDS, PrometheusMiddleware, register_snapshot, timed,
+)
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from payload_validation import PayloadError, SUBMIT_MAX_BATCH_BYTES, loads, parse_payload, read_body, schemas
 from sqlalchemy import create_engine, Column, String, Integer
-from sqlalchemy.orm import sessionmaker, declarative_base, Session
+from sqlalchemy.orm import sessionmaker, declarative_base
 
 load_dotenv()  # loads from .env in the current folder by default
 
@@ -26,7 +42,18 @@ tags_metadata = [
     },
 ]
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await aensure_indexes()
+    if METRICS_INGEST_MODE == "buffered":
+        await write_buffer.start()
+    yield
+    # Drain queued metrics before the Mongo client goes away
+    await write_buffer.stop()
+    await aclose()
+
 app = FastAPI(
+    lifespan=lifespan,
     title="GreenDIGIT WP6.2 CIM Metrics API",
     description=(
         "API for publishing metrics.\n\n"
@@ -40,6 +67,8 @@ app = FastAPI(
     swagger_ui_parameters={"persistAuthorization": True},
     root_path="/gd-cim-api"
 )
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(PrometheusMiddleware)  # outermost: timings include (de)compression
 security = HTTPBearer()
 
 # Secret key for JWT
@@ -50,6 +79,13 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_SECONDS = 86400 # 1 day
 JWT_ISSUER = os.environ.get("JWT_ISSUER", "greendigit-login-uva")
 
+# Maximum number of metrics accepted by a single POST /submit/batch
+SUBMIT_MAX_BATCH = int(os.environ.get("SUBMIT_MAX_BATCH", "1000"))
+# Page size of GET /metrics/me (JSON mode)
+METRICS_PAGE_DEFAULT = int(os.environ.get("METRICS_PAGE_DEFAULT", "100"))
+METRICS_PAGE_MAX = int(os.environ.get("METRICS_PAGE_MAX", "1000"))
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl", "application/x-jsonlines")
+
 # SQLite setup
 SQLALCHEMY_DATABASE_URL = "sqlite:///./users.db"
 engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
@@ -70,36 +106,72 @@ class SubmitData(BaseModel):
     field1: str
     field2: int
 
-def get_db():
+def get_user(email: str):
     db = SessionLocal()
     try:
-        yield db
+        return db.query(User).filter(User.email == email).first()
     finally:
         db.close()
 
-def load_allowed_emails():
-    path = os.path.join(os.path.dirname(__file__), "allowed_emails.txt")
-    if not os.path.exists(path):
-        return set()
-    with open(path, "r") as f:
-        return set(line.strip().lower() for line in f if line.strip())
+def create_user(email: str, hashed_password: str):
+    db = SessionLocal()
+    try:
+        db_user = User(email=email, hashed_password=hashed_password)
+        db.add(db_user)
+        db.commit()
+        db.refresh(db_user)
+        return db_user
+    finally:
+        db.close()
+
+def set_password(email: str, hashed_password: str) -> bool:
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.email == email).first()
+        if not user:
+            return False
+        user.hashed_password = hashed_password
+        db.commit()
+        return True
+    finally:
+        db.close()
+
+async def run_bcrypt(op: str, fn, *args):
+    """Run a passlib hash/verify on the bcrypt pool; 503 when the pool is saturated."""
+    def call():
+        with timed(BCRYPT_SECONDS.labels(op)):
+            return fn(*args)
+    try:
+        return await hasher.run(call)
+    except LoginBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
 
-def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(get_db)):
+def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     token = credentials.credentials
+    cached_email = token_cache.get(token)
+    if cached_email is not None:
+        return cached_email
     try:
-        payload = jwt.decode(
-            token,
-            SECRET_KEY,
-            algorithms=[ALGORITHM],
-            options={"require": ["sub", "exp", "iat", "nbf", "iss"]},
-            issuer=JWT_ISSUER
-        )
+        with timed(JWT_DECODE_SECONDS):
+            payload = jwt.decode(
+                token,
+                SECRET_KEY,
+                algorithms=[ALGORITHM],
+                options={"require": ["sub", "exp", "iat", "nbf", "iss"]},
+                issuer=JWT_ISSUER
+            )
         email: str = payload.get("sub")
         if email is None:
             raise HTTPException(status_code=401, detail="Invalid token")
-        user = db.query(User).filter(User.email == email).first()
+        # Only cache misses touch users.db
+        db = SessionLocal()
+        try:
+            user = db.query(User).filter(User.email == email).first()
+        finally:
+            db.close()
         if not user:
             raise HTTPException(status_code=401, detail="Invalid token")
+        token_cache.put(token, email, exp=payload.get("exp"))
         return email
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
@@ -112,24 +184,30 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security),
         "Use form fields `username` (email) and `password`.\n\n"
         "Returns a JWT for `Authorization: Bearer <token>`."
     ),
-    response_class=HTMLResponse
+    response_class=HTMLResponse,
+    responses={
+        429: {"description": "Too many login attempts for this email or address; retry after `Retry-After` seconds"},
+        503: {"description": "Too many logins in progress; retry after `Retry-After` seconds"},
+    },
 )
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends()):
     email_lower = form_data.username.strip().lower()
-    user = db.query(User).filter(User.email == email_lower).first()
+    # Rate limits are checked before any bcrypt work is spent on the attempt
+    try:
+        check_login_rate(email_lower, client_ip(request))
+    except RateLimited as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    user = await run_in_threadpool(get_user, email_lower)
     if not user:
         # First login: check if allowed, then register
-        allowed_emails = load_allowed_emails()
-        if email_lower not in allowed_emails:
+        if email_lower not in allowed_emails.get():
             raise HTTPException(status_code=403, detail="Email not allowed")
-        hashed_password = pwd_context.hash(form_data.password)
-        db_user = User(email=email_lower, hashed_password=hashed_password)
-        db.add(db_user)
-        db.commit()
-        db.refresh(db_user)
-        user = db_user
-    elif not pwd_context.verify(form_data.password, user.hashed_password):
-        raise HTTPException(status_code=400, detail="Incorrect password. \n If you have forgotten your password please contact the GreenDIGIT team: goncalo.ferreira@student.uva.nl.")
+        hashed_password = await run_bcrypt("hash", pwd_context.hash, form_data.password)
+        user = await run_in_threadpool(create_user, email_lower, hashed_password)
+    else:
+        password_ok = await run_bcrypt("verify", pwd_context.verify, form_data.password, user.hashed_password)
+        if not password_ok:
+            raise HTTPException(status_code=400, detail="Incorrect password. \n If you have forgotten your password please contact the GreenDIGIT team: goncalo.ferreira@student.uva.nl.")
     now = int(time.time())
     token_data = {
         "sub": user.email,
@@ -490,77 +568,279 @@ def token_ui():
         "**Requires:** `Authorization: Bearer <token>`.\n\n"
         "The `publisher_email` is derived from the token’s `sub` claim."
     ),
+    # The body is read and parsed by the handler (fast parser + schema check), so
+    # it is documented here instead of being declared as a Body() parameter
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {"application/json": {
+                "schema": {},
+                "examples": {"sample": {
+                    "summary": "Example metric payload",
+                    "value": {
+                        "cpu_watts": 11.2,
+                        "mem_bytes": 734003200,
+                        "labels": {"node": "compute-0", "job_id": "abc123"}
+                    },
+                }},
+            }},
+        },
+    },
     responses={
         200: {"description": "Stored successfully"},
         400: {"description": "Invalid JSON body"},
         401: {"description": "Missing/invalid Bearer token"},
+        413: {"description": "Body too large"},
+        422: {"description": "Body does not match the publisher's JSON schema"},
+        429: {"description": "Write buffer full (buffered mode); retry after `Retry-After` seconds"},
+        503: {"description": "Write buffer not running (buffered mode); retry after `Retry-After` seconds"},
         500: {"description": "Database error"},
     },
 )
 async def submit(
     request: Request,
     publisher_email: str = Depends(verify_token),
-    _example: Any = Body(
-        default=None,
-        examples={
-            "sample": {
-                "summary": "Example metric payload",
-                "value": {
-                    "cpu_watts": 11.2,
-                    "mem_bytes": 734003200,
-                    "labels": {"node": "compute-0", "job_id": "abc123"}
-                },
-            }
-        },
-    ),
 ):
-    body = await request.json()
-    ack = store_metric(publisher_email=publisher_email, body=body)
+    try:
+        body = parse_payload(await read_body(request), publisher_email)
+    except PayloadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    if METRICS_INGEST_MODE == "buffered":
+        try:
+            return {"stored": write_buffer.submit(publisher_email=publisher_email, body=body)}
+        except BufferFull as e:
+            raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+        except BufferUnavailable as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    ack = await astore_metric(publisher_email=publisher_email, body=body)
     if not ack.get("ok"):
         raise HTTPException(status_code=500, detail=f"DB error: {ack.get('error')}")
     return {"stored": ack}
 
+def parse_batch_body(raw: bytes, content_type: str, publisher_email: str) -> list:
+    """
+    Split a batch body into items. Returns a list of (body, error) tuples,
+    one per metric, where exactly one of both is set.
+    - NDJSON (one JSON document per line) keeps going past malformed lines.
+    - Anything else must be a single JSON array.
+    Every item is validated against the publisher's schema, if any.
+    """
+    if content_type.split(";")[0].strip().lower() in NDJSON_CONTENT_TYPES:
+        docs = []
+        for line in raw.splitlines():
+            if not line.strip():
+                continue
+            try:
+                docs.append((loads(line), None))
+            except PayloadError as e:
+                docs.append((None, e.detail))
+    else:
+        try:
+            data = loads(raw)
+        except PayloadError as e:
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
+        if not isinstance(data, list):
+            raise HTTPException(status_code=400, detail="Expected a JSON array (or NDJSON) of metrics")
+        docs = [(item, None) for item in data]
+
+    items = []
+    for body, error in docs:
+        if error is None:
+            try:
+                schemas.validate(publisher_email, body)
+            except PayloadError as e:
+                if e.status_code >= 500:
+                    raise HTTPException(status_code=e.status_code, detail=e.detail)
+                body, error = None, e.detail
+        items.append((body, error))
+    return items
+
+@app.post(
+    "/submit/batch",
+    tags=["Metrics"],
+    summary="Submit many metrics JSON payloads at once",
+    description=(
+        "Stores every element of a JSON array (or every line of an NDJSON body, "
+        "with `Content-Type: application/x-ndjson`) as its own metric entry, "
+        "using a single database round trip.\n\n"
+        "**Requires:** `Authorization: Bearer <token>`.\n\n"
+        f"At most `{SUBMIT_MAX_BATCH}` metrics per request. "
+        "The response holds one result per item, in input order."
+    ),
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {
+                    "schema": {"type": "array", "items": {}},
+                    "examples": {"sample": {
+                        "summary": "Example batch payload",
+                        "value": [
+                            {"cpu_watts": 11.2, "labels": {"node": "compute-0"}},
+                            {"cpu_watts": 9.8, "labels": {"node": "compute-1"}},
+                        ],
+                    }},
+                },
+                "application/x-ndjson": {"schema": {"type": "string"}},
+            },
+        },
+    },
+    responses={
+        200: {"description": "Batch processed; see per-item results"},
+        400: {"description": "Invalid JSON body"},
+        401: {"description": "Missing/invalid Bearer token"},
+        413: {"description": "Too many metrics in one batch, or body too large"},
+        429: {"description": "Write buffer full (buffered mode); retry after `Retry-After` seconds"},
+        503: {"description": "Write buffer not running (buffered mode); retry after `Retry-After` seconds"},
+        500: {"description": "Database error"},
+    },
+)
+async def submit_batch(
+    request: Request,
+    publisher_email: str = Depends(verify_token),
+):
+    try:
+        raw = await read_body(request, SUBMIT_MAX_BATCH_BYTES)
+    except PayloadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    items = parse_batch_body(raw, request.headers.get("content-type", ""), publisher_email)
+    if len(items) > SUBMIT_MAX_BATCH:
+        raise HTTPException(status_code=413, detail=f"Batch too large: {len(items)} > {SUBMIT_MAX_BATCH}")
+
+    valid = [body for body, error in items if error is None]
+    if METRICS_INGEST_MODE == "buffered":
+        try:
+            acks = iter(write_buffer.submit_batch(publisher_email=publisher_email, bodies=valid))
+        except BufferFull as e:
+            raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+        except BufferUnavailable as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    else:
+        acks = iter(await astore_metrics_batch(publisher_email=publisher_email, bodies=valid))
+    results = []
+    for i, (_, error) in enumerate(items):
+        ack = {"ok": False, "error": error} if error is not None else next(acks)
+        results.append({"index": i, **ack})
+
+    stored = sum(1 for r in results if r["ok"])
+    if valid and stored == 0 and all(error is None for _, error in items):
+        raise HTTPException(status_code=500, detail=f"DB error: {results[0].get('error')}")
+    return {"stored": stored, "failed": len(results) - stored, "results": results}
+
+def serialize_metric(d: dict) -> dict:
+    # Convert ObjectId and datetime to strings
+    d["_id"] = str(d["_id"])
+    if "timestamp" in d and not isinstance(d["timestamp"], str):
+        d["timestamp"] = ts_to_iso(d["timestamp"]) if isinstance(d["timestamp"], datetime) else str(d["timestamp"])
+    return d
+
 @app.get(
     "/metrics/me",
     tags=["Metrics"],
     summary="List my published metrics",
     description=(
-        "Returns all metrics published by the authenticated user.\n\n"
-        "**Requires:** `Authorization: Bearer <token>`."
+        "Returns the metrics published by the authenticated user, newest first.\n\n"
+        "**Requires:** `Authorization: Bearer <token>`.\n\n"
+        "Results are paginated: when more metrics exist, the response carries an "
+        "`X-Next-Cursor` header; pass its value as `cursor` to get the next page. "
+        "With `format=ndjson` the (optionally limited) result is streamed as one JSON "
+        "document per line instead."
     ),
     responses={
         200: {"description": "List of metrics"},
+        400: {"description": "Invalid cursor, time bound or field"},
         401: {"description": "Missing/invalid Bearer token"},
     },
 )
-def get_my_metrics(publisher_email: str = Depends(verify_token)):
-    # Query all documents for this publisher
-    docs = list(_col.find({"publisher_email": publisher_email}).sort("timestamp", -1))
-    # Convert ObjectId and datetime to strings
-    for d in docs:
-        d["_id"] = str(d["_id"])
-        if "timestamp" in d and not isinstance(d["timestamp"], str):
-            d["timestamp"] = str(d["timestamp"])
-    return docs
+async def get_my_metrics(
+    response: Response,
+    publisher_email: str = Depends(verify_token),
+    limit: Optional[int] = Query(None, ge=1, le=METRICS_PAGE_MAX, description=f"Page size (JSON default {METRICS_PAGE_DEFAULT}; NDJSON default: everything)"),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from a previous `X-Next-Cursor` header"),
+    since: Optional[str] = Query(None, description="ISO 8601 lower bound on timestamp (inclusive)"),
+    until: Optional[str] = Query(None, description="ISO 8601 upper bound on timestamp (exclusive)"),
+    fields: Optional[str] = Query(None, description="Comma separated fields to return, e.g. `body.cpu_watts,body.labels`"),
+    format: str = Query("json", pattern="^(json|ndjson)$", description="`json` page or `ndjson` stream"),
+):
+    projection = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+    query = {"after": cursor, "since": since, "until": until, "fields": projection}
+
+    if format == "ndjson":
+        docs = aiter_metrics(publisher_email, limit=limit, **query)
+        try:
+            # Pull the first document now so bad parameters still produce a 400
+            first = await anext(docs, None)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        async def lines():
+            if first is None:
+                return
+            yield json.dumps(serialize_metric(first), default=str) + "\n"
+            async for d in docs:
+                yield json.dumps(serialize_metric(d), default=str) + "\n"
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    try:
+        docs, next_cursor = await afind_metrics(publisher_email, limit=limit or METRICS_PAGE_DEFAULT, **query)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return [serialize_metric(d) for d in docs]
 
 
 class PasswordResetRequest(BaseModel):
     new_password: str
 
 @app.post("/reset-password", tags=["Auth"], summary="Reset my password")
-def reset_password(
+async def reset_password(
     data: PasswordResetRequest,
     publisher_email: str = Depends(verify_token),
-    db: Session = Depends(get_db)
 ):
     """
     Reset the password for the currently logged-in user.
     Requires a valid Authorization: Bearer <token>.
     """
-    user = db.query(User).filter(User.email == publisher_email).first()
-    if not user:
+    hashed_password = await run_bcrypt("hash", pwd_context.hash, data.new_password)
+    if not await run_in_threadpool(set_password, publisher_email, hashed_password):
         raise HTTPException(status_code=404, detail="User not found")
+    token_cache.invalidate_user(publisher_email)
+    return {"msg": "Password updated successfully"}
+
+
+@app.get("/internal/token-cache", include_in_schema=False)
+def token_cache_stats():
+    """Hit/miss counters of the in-process token verification cache."""
+    return token_cache.stats()
+
+
+@app.get("/internal/write-buffer", include_in_schema=False)
+def write_buffer_stats():
+    """Queue depth and flush counters of the write-behind buffer."""
+    return write_buffer.snapshot()
+
+
+@app.get("/internal/compression", include_in_schema=False)
+def compression_stats():
+    """Wire vs decoded byte counters per Content-Encoding."""
+    return compression_snapshot()
+
+
+@app.get("/internal/login", include_in_schema=False)
+def login_guard_stats():
+    """bcrypt pool occupancy and rate limiter counters."""
+    return login_guard_snapshot()
+
+
+register_snapshot("token_cache", token_cache.stats)
+register_snapshot("write_buffer", write_buffer.snapshot)
+register_snapshot("compression", compression_snapshot, label="encoding")
+register_snapshot("login", login_guard_snapshot, label="component")
+
 
-    user.hashed_password = pwd_context.hash(data.new_password)
-    db.commit()
-    return {"msg": "Password updated successfully"}
\ No newline at end of file
+@app.get("/internal/metrics", include_in_schema=False)
+def prometheus_metrics():
+    """Prometheus/OpenMetrics scrape endpoint."""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
\ No newline at end of file
@@ -0,0 +1,230 @@
+# metrics_buffer.py
+# Purpose: write-behind ingestion mode for metrics_store. Metrics are queued in
+# memory, acked immediately, and written by one background task with group
+# commits (insert_many) of up to BUFFER_FLUSH_DOCS documents or every
+# BUFFER_FLUSH_MS milliseconds, whichever comes first.
+#
+# Trade-off: acked metrics that are still queued are lost if the process dies
+# without a graceful shutdown. Use METRICS_INGEST_MODE=direct when that matters.
+#
+# Retries resend a batch after an error that may have come after part of it was
+# written. A regular collection rejects those documents again (duplicate _id);
+# a time-series collection (METRICS_TIMESERIES) does not enforce a unique _id,
+# so there the documents already stored are looked up and left out first.
+
+import asyncio
+import os
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from instrumentation import mongo_op
+from metrics_store import METRICS_TIMESERIES, _acol, _ack, _batch_docs, _new_doc
+
+METRICS_INGEST_MODE = os.getenv("METRICS_INGEST_MODE", "direct")  # direct | buffered
+BUFFER_FLUSH_DOCS = int(os.getenv("BUFFER_FLUSH_DOCS", "1000"))
+BUFFER_FLUSH_MS = int(os.getenv("BUFFER_FLUSH_MS", "200"))
+BUFFER_MAX_QUEUED = int(os.getenv("BUFFER_MAX_QUEUED", "100000"))
+BUFFER_MAX_RETRIES = int(os.getenv("BUFFER_MAX_RETRIES", "5"))
+BUFFER_DRAIN_TIMEOUT_SECONDS = float(os.getenv("BUFFER_DRAIN_TIMEOUT_SECONDS", "30"))
+
+DUPLICATE_KEY = 11000
+
+
+class BufferFull(Exception):
+    """Raised when the queue cannot take more documents; retry after `retry_after` seconds."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Write buffer full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class BufferUnavailable(Exception):
+    """Raised when no background task is writing the queue (stopping, or crashed); -> 503."""
+
+    def __init__(self, retry_after: int = 1):
+        super().__init__("Write buffer is not running, retry shortly")
+        self.retry_after = retry_after
+
+
+class WriteBehindBuffer:
+    def __init__(self, collection=_acol, flush_docs: int = BUFFER_FLUSH_DOCS,
+                 flush_ms: int = BUFFER_FLUSH_MS, max_queued: int = BUFFER_MAX_QUEUED,
+                 max_retries: int = BUFFER_MAX_RETRIES, unique_ids: bool = not METRICS_TIMESERIES):
+        self.collection = collection
+        self.unique_ids = unique_ids  # does the collection reject a second insert of an _id?
+        self.flush_docs = flush_docs
+        self.flush_ms = flush_ms
+        self.max_queued = max_queued
+        self.max_retries = max_retries
+        self._pending: Deque[Dict[str, Any]] = deque()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self._in_flight = 0  # documents of the batch being written
+        self.stats = {
+            "accepted": 0,
+            "written": 0,
+            "flushes": 0,
+            "rejected": 0,
+            "retries": 0,
+            "dropped": 0,
+        }
+
+    # --- Producer side (request handlers) ---
+
+    def _enqueue(self, docs: List[Dict[str, Any]]) -> None:
+        if self._task is None or self._closing or self._task.done():
+            # Acking now would queue documents nothing is going to write
+            raise BufferUnavailable()
+        if len(self._pending) + len(docs) > self.max_queued:
+            self.stats["rejected"] += len(docs)
+            raise BufferFull(retry_after=self.retry_after())
+        self._pending.extend(docs)
+        self.stats["accepted"] += len(docs)
+        self._wakeup.set()
+
+    def submit(self, publisher_email: str, body: Any, timestamp_iso: str | None = None) -> Dict[str, Any]:
+        """Queue one metric. The ack's id is final: _id is assigned before queueing."""
+        doc = _new_doc(publisher_email, body, timestamp_iso)
+        doc.setdefault("_id", ObjectId())
+        self._enqueue([doc])
+        return {**_ack(doc), "queued": True}
+
+    def submit_batch(self, publisher_email: str, bodies: List[Any], timestamp_iso: str | None = None) -> List[Dict[str, Any]]:
+        """Queue a whole batch, or none of it (BufferFull)."""
+        docs = _batch_docs(publisher_email, bodies, timestamp_iso)
+        for doc in docs:
+            doc.setdefault("_id", ObjectId())
+        self._enqueue(docs)
+        return [{**_ack(doc), "queued": True} for doc in docs]
+
+    def retry_after(self) -> int:
+        # Rough time to drain the current queue at one full group commit per flush interval
+        flushes = len(self._pending) / max(self.flush_docs, 1)
+        return max(1, int(flushes * self.flush_ms / 1000) + 1)
+
+    @property
+    def depth(self) -> int:
+        return len(self._pending)
+
+    # --- Lifecycle ---
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._closing = False
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+            self._task.add_done_callback(self._task_done)
+
+    def _task_done(self, task: asyncio.Task) -> None:
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is not None:
+            print(f"Write buffer task died: {error!r}; {len(self._pending)} queued metrics will not be written")
+        elif not self._closing:
+            print("Write buffer task exited unexpectedly")
+
+    async def stop(self, timeout: float = BUFFER_DRAIN_TIMEOUT_SECONDS) -> None:
+        """Stop accepting documents and flush what is queued (bounded by `timeout`)."""
+        if self._task is None:
+            return
+        self._closing = True
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except asyncio.TimeoutError:
+            self._task.cancel()
+            dropped = len(self._pending) + self._in_flight
+            self.stats["dropped"] += dropped
+            print(f"Write buffer drain timed out, dropped {dropped} queued metrics")
+            self._pending.clear()
+            self._in_flight = 0
+        self._task = None
+
+    # --- Consumer side (single background task) ---
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._pending:
+                if self._closing:
+                    return
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            # Group commit: wait for N documents or T ms after the first one
+            deadline = loop.time() + self.flush_ms / 1000
+            while len(self._pending) < self.flush_docs and not self._closing:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            n = min(len(self._pending), self.flush_docs)
+            batch = [self._pending.popleft() for _ in range(n)]
+            self._in_flight = len(batch)
+            await self._flush(batch)
+            self._in_flight = 0
+
+    async def _unwritten(self, batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """The documents of `batch` not stored yet (by _id, within the batch's time range)."""
+        stamps = [doc["timestamp"] for doc in batch]
+        query = {"_id": {"$in": [doc["_id"] for doc in batch]},
+                 "timestamp": {"$gte": min(stamps), "$lte": max(stamps)}}
+        with mongo_op("buffer_find_written"):
+            written = {doc["_id"] async for doc in self.collection.find(query, {"_id": 1})}
+        return [doc for doc in batch if doc["_id"] not in written]
+
+    async def _flush(self, batch: List[Dict[str, Any]]) -> None:
+        for attempt in range(self.max_retries + 1):
+            try:
+                if attempt and not self.unique_ids:
+                    # The failed attempt may have written part of the batch
+                    remaining = await self._unwritten(batch)
+                    self.stats["written"] += len(batch) - len(remaining)
+                    batch = remaining
+                    if not batch:
+                        break
+                with mongo_op("buffer_insert_many"):
+                    await self.collection.insert_many(batch, ordered=False)
+                self.stats["written"] += len(batch)
+                break
+            except BulkWriteError as e:
+                # Duplicate keys are documents a previous attempt already wrote
+                errors = [err for err in e.details.get("writeErrors", []) if err.get("code") != DUPLICATE_KEY]
+                self.stats["written"] += len(batch) - len(errors)
+                self.stats["dropped"] += len(errors)
+                break
+            except PyMongoError as e:
+                if attempt == self.max_retries:
+                    self.stats["dropped"] += len(batch)
+                    print(f"Write buffer dropped {len(batch)} metrics after {attempt + 1} attempts: {e}")
+                    break
+                self.stats["retries"] += 1
+                await asyncio.sleep(min(0.1 * 2 ** attempt, 5.0))
+            except Exception as e:
+                # Not retryable (e.g. InvalidDocument, DocumentTooLarge): drop the batch, keep the task alive
+                self.stats["dropped"] += len(batch)
+                print(f"Write buffer dropped {len(batch)} metrics: {e!r}")
+                break
+        self.stats["flushes"] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "mode": METRICS_INGEST_MODE,
+            "depth": self.depth,
+            "max_queued": self.max_queued,
+            "flush_docs": self.flush_docs,
+            "flush_ms": self.flush_ms,
+            **self.stats,
+        }
+
+
+write_buffer = WriteBehindBuffer()
@@ -1,10 +1,12 @@
 import os
 from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 from pymongo import MongoClient, ASCENDING, ReturnDocument
 from bson.objectid import ObjectId
 
+from metrics_store import to_stored_ts, ts_to_iso
+
 """
 # All metrics (optionally filtered)
 docs = get_all_metrics()                       # everything
@@ -15,6 +17,11 @@ last_ts, last_id = get_cursor("kv_exporter")
 docs, new_ts, new_id = get_metrics_since(last_ts, last_id)
 # ...process docs...
 save_cursor("kv_exporter", new_ts, new_id)
+
+# Same, in bounded chunks (large backlogs)
+for docs, new_ts, new_id in iter_metrics_since(last_ts, last_id, chunk_size=5000):
+    # ...process docs...
+    save_cursor("kv_exporter", new_ts, new_id)
 """
 
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://metrics-db:27017/")
@@ -22,14 +29,16 @@ DB_NAME = os.getenv("METRICS_DB_NAME", "metricsdb")
 COLLECTION_NAME = os.getenv("METRICS_COLLECTION", "metrics")
 CURSORS_COLLECTION = os.getenv("CURSORS_COLLECTION", "cursors")
 
-_client = MongoClient(MONGO_URI)
+_client = MongoClient(MONGO_URI, tz_aware=True)
 _db = _client[DB_NAME]
 _col = _db[COLLECTION_NAME]
 _cursors = _db[CURSORS_COLLECTION]
 
 # Ensure helpful indexes
 _col.create_index([("publisher_email", ASCENDING)], name="ix_publisher_email")
-_col.create_index([("timestamp", ASCENDING)], name="ix_timestamp")
+# Serves the (timestamp, _id) keyset scans of the exporters as one index range
+# (and supersedes a plain ix_timestamp, which can be dropped)
+_col.create_index([("timestamp", ASCENDING), ("_id", ASCENDING)], name="ix_timestamp_id")
 
 def _to_dict(doc) -> Dict[str, Any]:
     d = dict(doc)
@@ -46,6 +55,32 @@ def get_all_metrics(publisher_email: Optional[str] = None, limit: Optional[int]
         cursor = cursor.limit(int(limit))
     return [_to_dict(d) for d in cursor]
 
+def _since_query(
+    since_ts_iso: Optional[str],
+    since_id: Optional[str],
+    publisher_email: Optional[str],
+) -> Dict[str, Any]:
+    """
+    Keyset predicate: documents strictly after (since_ts, since_id) in
+    (timestamp, _id) order, i.e. ts > since_ts OR (ts == since_ts AND _id > since_id).
+    Written as timestamp >= since_ts AND (ts > since_ts OR _id > since_id), so the
+    leading bound is a single range scan on ix_timestamp_id and the $or only
+    breaks ties at since_ts.
+    """
+    q: Dict[str, Any] = {}
+    if publisher_email:
+        q["publisher_email"] = publisher_email
+
+    if since_ts_iso and since_id:
+        ts = to_stored_ts(since_ts_iso)
+        q["timestamp"] = {"$gte": ts}
+        q["$or"] = [{"timestamp": {"$gt": ts}}, {"_id": {"$gt": ObjectId(since_id)}}]
+    elif since_ts_iso:
+        q["timestamp"] = {"$gt": to_stored_ts(since_ts_iso)}
+    elif since_id:
+        q["_id"] = {"$gt": ObjectId(since_id)}
+    return q
+
 def get_metrics_since(
     since_ts_iso: Optional[str] = None,
     since_id: Optional[str] = None,
@@ -53,24 +88,11 @@ def get_metrics_since(
     limit: Optional[int] = None,
 ) -> Tuple[List[Dict[str, Any]], Optional[str], Optional[str]]:
     """
-    Return metrics created after a watermark (timestamp and/or ObjectId).
-    Use both for robustness: timestamp can tie, ObjectId is monotonic.
+    Return metrics after a watermark, in (timestamp, _id) order.
+    Pass both: timestamps can tie, _id breaks the tie.
     Returns: (docs, last_ts_iso, last_id)
     """
-    q: Dict[str, Any] = {}
-    if publisher_email:
-        q["publisher_email"] = publisher_email
-
-    # Build "greater than" conditions
-    gt_clauses: List[Dict[str, Any]] = []
-    if since_ts_iso:
-        gt_clauses.append({"timestamp": {"$gt": since_ts_iso}})
-    if since_id:
-        gt_clauses.append({"_id": {"$gt": ObjectId(since_id)}})
-
-    if gt_clauses:
-        q["$or"] = gt_clauses
-
+    q = _since_query(since_ts_iso, since_id, publisher_email)
     cursor = _col.find(q).sort([("timestamp", 1), ("_id", 1)])
     if limit:
         cursor = cursor.limit(int(limit))
@@ -80,10 +102,42 @@ def get_metrics_since(
         return [], since_ts_iso, since_id
 
     last = docs[-1]
-    last_ts_iso = last.get("timestamp")
+    last_ts_iso = ts_to_iso(last.get("timestamp"))
     last_id = str(last["_id"])
     return ([_to_dict(d) for d in docs], last_ts_iso, last_id)
 
+def iter_metrics_since(
+    since_ts_iso: Optional[str] = None,
+    since_id: Optional[str] = None,
+    publisher_email: Optional[str] = None,
+    limit: Optional[int] = None,
+    chunk_size: int = 5000,
+) -> Iterator[Tuple[List[Dict[str, Any]], Optional[str], Optional[str]]]:
+    """
+    Like get_metrics_since, but yields (docs, last_ts_iso, last_id) per chunk of
+    at most `chunk_size` docs from a single cursor, so memory stays bounded.
+    The watermark of each chunk is safe to save once that chunk is processed.
+    """
+    q = _since_query(since_ts_iso, since_id, publisher_email)
+    cursor = _col.find(q).sort([("timestamp", 1), ("_id", 1)]).batch_size(chunk_size)
+    if limit:
+        cursor = cursor.limit(int(limit))
+    chunk: List[Dict[str, Any]] = []
+    try:
+        for doc in cursor:
+            chunk.append(doc)
+            if len(chunk) >= chunk_size:
+                yield _chunk(chunk)
+                chunk = []
+        if chunk:
+            yield _chunk(chunk)
+    finally:
+        cursor.close()
+
+def _chunk(docs: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Optional[str], Optional[str]]:
+    last = docs[-1]
+    return [_to_dict(d) for d in docs], ts_to_iso(last.get("timestamp")), str(last["_id"])
+
 # --- Cursor helpers (per-processor watermark) ---
 
 def get_cursor(processor_name: str) -> Tuple[Optional[str], Optional[str]]:
@@ -110,3 +164,16 @@ def save_cursor(processor_name: str, last_ts_iso: Optional[str], last_id: Option
         upsert=True,
         return_document=ReturnDocument.AFTER,
     )
+
+def get_resume_token(processor_name: str) -> Optional[Dict[str, Any]]:
+    """Change-stream resume token stored next to the processor's watermark."""
+    c = _cursors.find_one({"name": processor_name}, {"resume_token": 1})
+    return c.get("resume_token") if c else None
+
+def save_resume_token(processor_name: str, token: Optional[Dict[str, Any]]) -> None:
+    """Upsert (or clear, with None) the change-stream resume token of a processor."""
+    _cursors.update_one(
+        {"name": processor_name},
+        {"$set": {"resume_token": token, "updated_at": datetime.now(timezone.utc).isoformat()}},
+        upsert=True,
+    )
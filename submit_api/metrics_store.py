@@ -1,25 +1,118 @@
 # metrics_store.py
-# Purpose: create the DB/collection (with index) and provide a single function to store metrics.
+# Purpose: create the DB/collection (with index) and provide functions to store metrics.
+# The blocking functions (store_metric, ...) suit scripts and sync endpoints; the
+# a-prefixed coroutines (astore_metric, ...) use PyMongo's asyncio client so
+# async endpoints never block the event loop.
 
 import os
 import json
+import base64
+import re
 from datetime import datetime, timezone
-from typing import Any, Dict
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 
-from pymongo import MongoClient, ASCENDING
-from pymongo.errors import PyMongoError
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import AsyncMongoClient, MongoClient, ASCENDING, DESCENDING, WriteConcern
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from instrumentation import mongo_op
 
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://metrics-db:27017/")
 DB_NAME = os.getenv("METRICS_DB_NAME", "metricsdb")
 COLLECTION_NAME = os.getenv("METRICS_COLLECTION", "metrics")
 
-_client = MongoClient(MONGO_URI)
+# --- Time-series layout (see migrate_timeseries.py for existing data) ---
+# When enabled, the collection is a Mongo time-series collection with a native
+# datetime `timestamp` (timeField) and `publisher_email` as metaField.
+METRICS_TIMESERIES = os.getenv("METRICS_TIMESERIES", "").lower() in ("1", "true", "yes")
+METRICS_TS_GRANULARITY = os.getenv("METRICS_TS_GRANULARITY", "seconds")  # seconds | minutes | hours
+METRICS_TS_EXPIRE_SECONDS = int(os.getenv("METRICS_TS_EXPIRE_SECONDS", "0"))  # 0 = keep forever
+
+# --- Connection pool / write concern (shared by the sync and async clients) ---
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+# How long a request may wait for a free pooled connection before failing (0 = forever)
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "0"))
+# "majority", or a number of acknowledging members (0 = fire-and-forget)
+MONGO_WRITE_W = os.getenv("MONGO_WRITE_W", "1")
+MONGO_WRITE_JOURNAL = os.getenv("MONGO_WRITE_JOURNAL", "").lower() in ("1", "true", "yes")
+
+def _client_options() -> Dict[str, Any]:
+    # tz_aware: native timestamps come back as UTC-aware datetimes
+    opts: Dict[str, Any] = {"tz_aware": True, "maxPoolSize": MONGO_MAX_POOL_SIZE, "minPoolSize": MONGO_MIN_POOL_SIZE}
+    if MONGO_WAIT_QUEUE_TIMEOUT_MS > 0:
+        opts["waitQueueTimeoutMS"] = MONGO_WAIT_QUEUE_TIMEOUT_MS
+    return opts
+
+_write_concern = WriteConcern(
+    w=int(MONGO_WRITE_W) if MONGO_WRITE_W.isdigit() else MONGO_WRITE_W,
+    j=True if MONGO_WRITE_JOURNAL else None,
+)
+
+def timeseries_options() -> Dict[str, Any]:
+    opts: Dict[str, Any] = {
+        "timeseries": {
+            "timeField": "timestamp",
+            "metaField": "publisher_email",
+            "granularity": METRICS_TS_GRANULARITY,
+        }
+    }
+    if METRICS_TS_EXPIRE_SECONDS > 0:
+        opts["expireAfterSeconds"] = METRICS_TS_EXPIRE_SECONDS
+    return opts
+
+def ensure_collection(db, name: str = COLLECTION_NAME) -> None:
+    """Create the metrics collection as a time-series collection when METRICS_TIMESERIES is set."""
+    if not METRICS_TIMESERIES:
+        return
+    info = next(iter(db.list_collections(filter={"name": name})), None)
+    if info is None:
+        db.create_collection(name, **timeseries_options())
+    elif info.get("type") != "timeseries":
+        print(f"METRICS_TIMESERIES is set but '{name}' is a regular collection; run migrate_timeseries.py")
+
+def to_stored_ts(ts: str | datetime) -> str | datetime:
+    """A timestamp in the stored representation: datetime (time-series mode) or ISO string."""
+    if METRICS_TIMESERIES:
+        if isinstance(ts, str):
+            ts = datetime.fromisoformat(ts.replace("Z", "+00:00"))
+        return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+    return ts.isoformat() if isinstance(ts, datetime) else ts
+
+def ts_to_iso(ts: str | datetime) -> str:
+    if isinstance(ts, datetime):
+        return (ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)).isoformat()
+    return ts
+
+_client = MongoClient(MONGO_URI, **_client_options())
 _db = _client[DB_NAME]
-_col = _db[COLLECTION_NAME]
+ensure_collection(_db)
+_col = _db.get_collection(COLLECTION_NAME, write_concern=_write_concern)
+
+# Async client: connects lazily, on the event loop of its first operation
+_aclient = AsyncMongoClient(MONGO_URI, **_client_options())
+_acol = _aclient[DB_NAME].get_collection(COLLECTION_NAME, write_concern=_write_concern)
 
 # Ensure index on publisher_email for fast lookup
 _col.create_index([("publisher_email", ASCENDING)], name="ix_publisher_email")
 
+def _new_doc(publisher_email: str, body: Any, timestamp_iso: str | None = None) -> Dict[str, Any]:
+    ts = datetime.now(timezone.utc) if timestamp_iso is None else timestamp_iso
+    return {
+        "timestamp": to_stored_ts(ts),
+        "publisher_email": publisher_email,
+        "body": body,  # Mongo stores this as native BSON/JSON (no stringifying required)
+    }
+
+def _ack(doc: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "ok": True,
+        "id": str(doc["_id"]),
+        "timestamp": ts_to_iso(doc["timestamp"]),
+        "publisher_email": doc["publisher_email"],
+    }
+
 def store_metric(publisher_email: str, body: Any, timestamp_iso: str | None = None) -> Dict[str, Any]:
     """
     Insert one metric document.
@@ -28,22 +121,200 @@ def store_metric(publisher_email: str, body: Any, timestamp_iso: str | None = No
     - timestamp is set server-side (UTC) unless provided.
     Returns a minimal ack with inserted_id and timestamp.
     """
-    if timestamp_iso is None:
-        timestamp_iso = datetime.now(timezone.utc).isoformat()
+    doc = _new_doc(publisher_email, body, timestamp_iso)
+    try:
+        with mongo_op("insert_one"):
+            _col.insert_one(doc)
+        return _ack(doc)
+    except PyMongoError as e:
+        return {"ok": False, "error": str(e)}
 
-    doc = {
-        "timestamp": timestamp_iso,
-        "publisher_email": publisher_email,
-        "body": body,  # Mongo stores this as native BSON/JSON (no stringifying required)
-    }
+def _batch_docs(publisher_email: str, bodies: List[Any], timestamp_iso: str | None) -> List[Dict[str, Any]]:
+    ts = to_stored_ts(datetime.now(timezone.utc) if timestamp_iso is None else timestamp_iso)
+    return [_new_doc(publisher_email, body, ts) for body in bodies]
 
+def _batch_acks(docs: List[Dict[str, Any]], errors: Dict[int, str]) -> List[Dict[str, Any]]:
+    return [
+        {"ok": False, "error": errors[i]} if i in errors else _ack(doc)
+        for i, doc in enumerate(docs)
+    ]
+
+def _write_errors(e: BulkWriteError) -> Dict[int, str]:
+    return {err["index"]: err.get("errmsg", "write error") for err in e.details.get("writeErrors", [])}
+
+def store_metrics_batch(publisher_email: str, bodies: List[Any], timestamp_iso: str | None = None) -> List[Dict[str, Any]]:
+    """
+    Insert many metric documents with a single unordered insert_many.
+    All documents of a batch share the same server-side timestamp unless provided.
+    Returns one ack per body, in input order. A failed document does not stop
+    the rest of the batch (ordered=False); its ack carries the error instead.
+    """
+    if not bodies:
+        return []
+    docs = _batch_docs(publisher_email, bodies, timestamp_iso)
+    errors: Dict[int, str] = {}
     try:
-        result = _col.insert_one(doc)
-        return {
-            "ok": True,
-            "id": str(result.inserted_id),
-            "timestamp": timestamp_iso,
-            "publisher_email": publisher_email,
-        }
+        # insert_many assigns _id client-side, so acks can be built from docs
+        with mongo_op("insert_many"):
+            _col.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        errors = _write_errors(e)
+    except PyMongoError as e:
+        return [{"ok": False, "error": str(e)} for _ in docs]
+    return _batch_acks(docs, errors)
+
+# --- Async (event-loop friendly) variants ---
+
+async def astore_metric(publisher_email: str, body: Any, timestamp_iso: str | None = None) -> Dict[str, Any]:
+    """Async store_metric: awaits the insert instead of blocking the event loop."""
+    doc = _new_doc(publisher_email, body, timestamp_iso)
+    try:
+        with mongo_op("insert_one"):
+            await _acol.insert_one(doc)
+        return _ack(doc)
     except PyMongoError as e:
         return {"ok": False, "error": str(e)}
+
+async def astore_metrics_batch(publisher_email: str, bodies: List[Any], timestamp_iso: str | None = None) -> List[Dict[str, Any]]:
+    """Async store_metrics_batch (single unordered insert_many)."""
+    if not bodies:
+        return []
+    docs = _batch_docs(publisher_email, bodies, timestamp_iso)
+    errors: Dict[int, str] = {}
+    try:
+        with mongo_op("insert_many"):
+            await _acol.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        errors = _write_errors(e)
+    except PyMongoError as e:
+        return [{"ok": False, "error": str(e)} for _ in docs]
+    return _batch_acks(docs, errors)
+
+# --- Reading back (keyset pagination, newest first) ---
+
+async def aensure_indexes() -> None:
+    """Indexes backing the per-publisher keyset pagination (idempotent; run at startup)."""
+    await _acol.create_index(
+        [("publisher_email", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)],
+        name="ix_publisher_ts_id",
+    )
+
+def encode_page_cursor(doc: Dict[str, Any]) -> str:
+    """Opaque cursor pointing just past `doc` in (timestamp, _id) order."""
+    ts = doc["timestamp"]
+    # Tag native datetimes so the cursor decodes back to the same BSON type
+    ts = {"$date": ts_to_iso(ts)} if isinstance(ts, datetime) else ts
+    raw = json.dumps([ts, str(doc["_id"])], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_page_cursor(cursor: str) -> Tuple[Any, ObjectId]:
+    """Inverse of encode_page_cursor. Raises ValueError on a malformed cursor."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        ts, oid = json.loads(raw)
+        if isinstance(ts, dict):
+            ts = datetime.fromisoformat(ts["$date"])
+        return ts, ObjectId(oid)
+    except (ValueError, TypeError, InvalidId) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+
+def parse_time_bound(value: str) -> str | datetime:
+    """Normalise a user supplied ISO 8601 bound to the stored timestamp format."""
+    dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return to_stored_ts(dt.astimezone(timezone.utc))
+
+def _page_query(
+    publisher_email: str,
+    after: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+) -> Dict[str, Any]:
+    clauses: List[Dict[str, Any]] = [{"publisher_email": publisher_email}]
+    if since:
+        clauses.append({"timestamp": {"$gte": parse_time_bound(since)}})
+    if until:
+        clauses.append({"timestamp": {"$lt": parse_time_bound(until)}})
+    if after:
+        ts, oid = decode_page_cursor(after)
+        # Keyset predicate for descending (timestamp, _id)
+        clauses.append({"$or": [
+            {"timestamp": {"$lt": ts}},
+            {"timestamp": ts, "_id": {"$lt": oid}},
+        ]})
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+# Projection fields: dotted paths of plain names. No "$" (operators, positional
+# projections), no empty segments
+FIELD_PATH = re.compile(r"[A-Za-z0-9_-]+(\.[A-Za-z0-9_-]+)*")
+
+def _projection(fields: Optional[List[str]]) -> Optional[Dict[str, int]]:
+    """Inclusion projection for `fields`. Raises ValueError on an invalid path."""
+    if not fields:
+        return None
+    invalid = [f for f in fields if not FIELD_PATH.fullmatch(f)]
+    if invalid:
+        raise ValueError(f"Invalid field: {', '.join(invalid)} (expected dotted names, e.g. body.cpu_watts)")
+    # timestamp and _id are always needed to build the next cursor.
+    # Mongo rejects overlapping paths ("a" and "a.b"): keep only the outermost,
+    # which includes the others
+    kept: List[str] = []
+    for path in sorted({"timestamp", "_id", *fields}):
+        if not any(path.startswith(k + ".") for k in kept):
+            kept.append(path)
+    return {path: 1 for path in kept}
+
+def _find_page(publisher_email, after, since, until, fields):
+    return _acol.find(
+        _page_query(publisher_email, after=after, since=since, until=until),
+        _projection(fields),
+    ).sort([("timestamp", DESCENDING), ("_id", DESCENDING)])
+
+async def afind_metrics(
+    publisher_email: str,
+    limit: int = 100,
+    after: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    fields: Optional[List[str]] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    One page of a publisher's metrics, newest first.
+    - after: cursor returned by the previous page (None for the first page).
+    - since/until: ISO 8601 bounds on timestamp (since inclusive, until exclusive).
+    - fields: optional projection (dotted paths, e.g. "body.cpu_watts").
+    Returns (docs, next_cursor); next_cursor is None on the last page.
+    """
+    cursor = _find_page(publisher_email, after, since, until, fields).limit(limit + 1)
+    with mongo_op("find"):
+        docs = await cursor.to_list(limit + 1)
+    if len(docs) <= limit:
+        return docs, None
+    docs = docs[:limit]
+    return docs, encode_page_cursor(docs[-1])
+
+async def aiter_metrics(
+    publisher_email: str,
+    limit: Optional[int] = None,
+    after: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    fields: Optional[List[str]] = None,
+    batch_size: int = 1000,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Same query as afind_metrics, yielded lazily from the server cursor.
+    Errors count as "find_stream" failures; its duration covers the whole
+    stream, including the time the consumer takes between documents.
+    """
+    cursor = _find_page(publisher_email, after, since, until, fields).batch_size(batch_size)
+    if limit:
+        cursor = cursor.limit(limit)
+    with mongo_op("find_stream"):
+        async for doc in cursor:
+            yield doc
+
+async def aclose() -> None:
+    """Release the async client's pooled connections (call on app shutdown)."""
+    await _aclient.close()
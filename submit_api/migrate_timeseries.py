@@ -0,0 +1,127 @@
+# migrate_timeseries.py
+# Purpose: convert the existing metrics collection into a Mongo time-series
+# collection (native datetime `timestamp`, `publisher_email` as metaField).
+#
+# Usage (stop the API and the watcher first, then restart them with METRICS_TIMESERIES=1):
+#   python migrate_timeseries.py [--batch-size 5000] [--drop-legacy]
+#
+# Steps:
+#   1. rename <collection> -> <collection>_legacy (regular collections can be renamed,
+#      time-series ones cannot, so the new collection takes over the original name)
+#   2. create <collection> as a time-series collection
+#   3. copy documents in _id order, in bulk, converting ISO timestamps to datetimes
+# Progress is checkpointed in the cursors collection, so an interrupted run can
+# simply be started again. The checkpoint is created before the first copy: a
+# target with documents but no checkpoint was not filled by this script, and
+# the migration refuses to run.
+
+import argparse
+import os
+from datetime import datetime, timezone
+from typing import Any, Dict
+
+from pymongo import ASCENDING, MongoClient, ReturnDocument
+
+from metrics_store import COLLECTION_NAME, DB_NAME, MONGO_URI, timeseries_options
+
+CURSORS_COLLECTION = os.getenv("CURSORS_COLLECTION", "cursors")
+CHECKPOINT_NAME = "timeseries_migration"
+
+
+def to_datetime(ts: Any) -> datetime:
+    if isinstance(ts, datetime):
+        return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+    dt = datetime.fromisoformat(str(ts).replace("Z", "+00:00"))
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+def convert(doc: Dict[str, Any]) -> Dict[str, Any]:
+    doc["timestamp"] = to_datetime(doc["timestamp"])
+    return doc
+
+
+def prepare(db, legacy_name: str) -> None:
+    names = set(db.list_collection_names())
+    info = next(iter(db.list_collections(filter={"name": COLLECTION_NAME})), None)
+    if info is not None and info.get("type") == "timeseries":
+        if legacy_name not in names:
+            raise SystemExit(f"'{COLLECTION_NAME}' is already a time-series collection and there is no '{legacy_name}' to copy from.")
+        return  # resuming
+    if info is not None:
+        if legacy_name in names:
+            raise SystemExit(f"Both '{COLLECTION_NAME}' and '{legacy_name}' exist as regular collections; resolve manually.")
+        db[COLLECTION_NAME].rename(legacy_name)
+        print(f"Renamed '{COLLECTION_NAME}' -> '{legacy_name}'")
+    db.create_collection(COLLECTION_NAME, **timeseries_options())
+    print(f"Created time-series collection '{COLLECTION_NAME}'")
+
+
+def migrate(batch_size: int, drop_legacy: bool) -> int:
+    client = MongoClient(MONGO_URI, tz_aware=True)
+    db = client[DB_NAME]
+    legacy_name = f"{COLLECTION_NAME}_legacy"
+    cursors = db[CURSORS_COLLECTION]
+    prepare(db, legacy_name)
+
+    legacy, target = db[legacy_name], db[COLLECTION_NAME]
+    checkpoint = cursors.find_one({"name": CHECKPOINT_NAME})
+    if checkpoint is None:
+        if target.find_one({}, {"_id": 1}) is not None:
+            raise SystemExit(f"'{COLLECTION_NAME}' already has documents but no migration checkpoint; "
+                             f"empty it or resolve manually.")
+        checkpoint = {"last_id": None, "copied": 0}
+        cursors.update_one({"name": CHECKPOINT_NAME}, {"$set": checkpoint}, upsert=True)
+    last_id = checkpoint.get("last_id")
+    q: Dict[str, Any] = {}
+    # A crash between insert and checkpoint leaves at most one batch copied twice
+    # (time-series collections do not reject duplicate _ids): remove it first
+    if last_id is not None:
+        q["_id"] = {"$gt": last_id}
+        target.delete_many({"_id": {"$gt": last_id}})
+    else:
+        target.delete_many({})
+
+    copied = checkpoint.get("copied", 0)
+    batch = []
+    for doc in legacy.find(q).sort("_id", ASCENDING).batch_size(batch_size):
+        batch.append(convert(doc))
+        if len(batch) >= batch_size:
+            copied += _flush(target, cursors, batch, copied)
+            batch = []
+    if batch:
+        copied += _flush(target, cursors, batch, copied)
+
+    legacy_count = legacy.estimated_document_count()
+    print(f"Copied {copied} of {legacy_count} documents into '{COLLECTION_NAME}'")
+    if drop_legacy:
+        if copied >= legacy_count:
+            legacy.drop()
+            cursors.delete_one({"name": CHECKPOINT_NAME})
+            print(f"Dropped '{legacy_name}'")
+        else:
+            print(f"Not dropping '{legacy_name}': copy is incomplete")
+    return copied
+
+
+def _flush(target, cursors, batch, copied_so_far: int) -> int:
+    target.insert_many(batch, ordered=False)
+    cursors.find_one_and_update(
+        {"name": CHECKPOINT_NAME},
+        {"$set": {
+            "last_id": batch[-1]["_id"],
+            "copied": copied_so_far + len(batch),
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+        }},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    print(f"  ... {copied_so_far + len(batch)} documents")
+    return len(batch)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate the metrics collection to a Mongo time-series collection.")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--drop-legacy", action="store_true", help="drop the legacy collection once everything is copied")
+    args = parser.parse_args()
+    migrate(args.batch_size, args.drop_legacy)
@@ -0,0 +1,119 @@
+# payload_validation.py
+# Purpose: parse and validate submitted metric payloads before they reach Mongo.
+# - Bodies are read with a size cap (413 without buffering the rest).
+# - JSON is parsed with orjson when installed, the stdlib parser otherwise.
+# - Optional per-publisher JSON schemas: schemas/<publisher_email>.json, or
+#   schemas/default.json for publishers without their own. Schemas are compiled
+#   once (fastjsonschema generates Python code) and recompiled only when the
+#   file changes.
+
+import json
+import os
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import fastjsonschema
+
+try:
+    import orjson
+except ImportError:  # orjson is an optional fast path
+    orjson = None
+
+SUBMIT_MAX_BODY_BYTES = int(os.getenv("SUBMIT_MAX_BODY_BYTES", str(1024 * 1024)))
+SUBMIT_MAX_BATCH_BYTES = int(os.getenv("SUBMIT_MAX_BATCH_BYTES", str(16 * 1024 * 1024)))
+PUBLISHER_SCHEMAS_DIR = os.getenv(
+    "PUBLISHER_SCHEMAS_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "schemas"),
+)
+SCHEMA_CHECK_SECONDS = float(os.getenv("SCHEMA_CHECK_SECONDS", "5"))
+DEFAULT_SCHEMA = "default"
+
+
+class PayloadError(Exception):
+    """A payload rejected before storage; `status_code` is the HTTP status to answer with."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def loads(raw: bytes) -> Any:
+    try:
+        if orjson is not None:
+            return orjson.loads(raw)
+        return json.loads(raw)
+    except ValueError as e:  # orjson.JSONDecodeError subclasses ValueError
+        raise PayloadError(400, f"Invalid JSON: {e}")
+
+
+async def read_body(request, max_bytes: int = SUBMIT_MAX_BODY_BYTES) -> bytes:
+    """Read the request body, failing with 413 as soon as it exceeds `max_bytes`."""
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > max_bytes:
+        raise PayloadError(413, f"Body exceeds {max_bytes} bytes")
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > max_bytes:
+            raise PayloadError(413, f"Body exceeds {max_bytes} bytes")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+class SchemaRegistry:
+    """Compiled validators per publisher, cached and keyed by the schema file's mtime."""
+
+    def __init__(self, directory: str = PUBLISHER_SCHEMAS_DIR, check_seconds: float = SCHEMA_CHECK_SECONDS):
+        self.directory = directory
+        self.check_seconds = check_seconds
+        # name -> (checked_at, mtime, validator or None)
+        self._cache: Dict[str, Tuple[float, Optional[float], Optional[Callable]]] = {}
+
+    def _load(self, name: str) -> Optional[Callable]:
+        now = time.monotonic()
+        entry = self._cache.get(name)
+        if entry is not None and now - entry[0] < self.check_seconds:
+            return entry[2]
+        path = os.path.join(self.directory, f"{name}.json")
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            mtime = None
+        if entry is not None and entry[1] == mtime:
+            self._cache[name] = (now, mtime, entry[2])
+            return entry[2]
+        validator = None
+        if mtime is not None:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    validator = fastjsonschema.compile(json.load(f))
+            except (OSError, ValueError, fastjsonschema.JsonSchemaDefinitionException) as e:
+                raise PayloadError(500, f"Invalid schema file {name}.json: {e}")
+        self._cache[name] = (now, mtime, validator)
+        return validator
+
+    def validator_for(self, publisher_email: str) -> Optional[Callable]:
+        if os.sep in publisher_email or publisher_email.startswith("."):
+            return self._load(DEFAULT_SCHEMA)
+        return self._load(publisher_email) or self._load(DEFAULT_SCHEMA)
+
+    def validate(self, publisher_email: str, body: Any) -> None:
+        validator = self.validator_for(publisher_email)
+        if validator is None:
+            return
+        try:
+            validator(body)
+        except fastjsonschema.JsonSchemaValueException as e:
+            raise PayloadError(422, f"Schema validation failed: {e.message}")
+
+
+schemas = SchemaRegistry()
+
+
+def parse_payload(raw: bytes, publisher_email: str) -> Any:
+    """Parse one metric body and validate it against the publisher's schema."""
+    body = loads(raw)
+    schemas.validate(publisher_email, body)
+    return body
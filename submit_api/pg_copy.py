@@ -0,0 +1,124 @@
+# pg_copy.py
+# Purpose: stream Python rows into Postgres with COPY ... FROM STDIN.
+# - Rows are encoded lazily while psycopg2 reads from a file-like object, so a
+#   load never holds more than one read buffer of encoded data.
+# - Text format (default) or binary format; binary skips parsing on the server
+#   side but only supports the column types below.
+#
+# Column types: "text", "float8", "int8", "timestamptz", "bool".
+# JSON values are staged as text and cast (::jsonb) by the statement that
+# merges the staging table.
+
+import struct
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, Iterator, Sequence
+
+COPY_FORMATS = ("text", "binary")
+
+_PG_EPOCH = datetime(2000, 1, 1, tzinfo=timezone.utc)
+_BINARY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+_BINARY_TRAILER = struct.pack("!h", -1)
+_NULL_FIELD = struct.pack("!i", -1)
+
+
+def to_datetime(ts: Any) -> datetime:
+    """ISO 8601 string or datetime -> aware datetime (naive values are UTC)."""
+    if not isinstance(ts, datetime):
+        ts = datetime.fromisoformat(str(ts).replace("Z", "+00:00"))
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+# --- Text format ---
+_TEXT_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+def _text_field(v: Any, pg_type: str) -> str:
+    if v is None:
+        return "\\N"
+    if pg_type == "timestamptz":
+        return v.isoformat() if isinstance(v, datetime) else str(v)
+    if pg_type == "float8":
+        return repr(float(v))
+    if pg_type == "bool":
+        return "t" if v else "f"
+    return str(v).translate(_TEXT_ESCAPES)
+
+
+def _encode_text(rows: Iterable[Sequence[Any]], types: Sequence[str]) -> Iterator[bytes]:
+    for row in rows:
+        yield ("\t".join([_text_field(v, t) for v, t in zip(row, types)]) + "\n").encode("utf-8")
+
+
+# --- Binary format ---
+def _bin_text(v: Any) -> bytes:
+    return str(v).encode("utf-8")
+
+
+def _bin_timestamptz(v: Any) -> bytes:
+    delta = to_datetime(v) - _PG_EPOCH
+    return struct.pack("!q", (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds)
+
+
+_BINARY_ENCODERS: Dict[str, Callable[[Any], bytes]] = {
+    "text": _bin_text,
+    "float8": lambda v: struct.pack("!d", float(v)),
+    "int8": lambda v: struct.pack("!q", int(v)),
+    "timestamptz": _bin_timestamptz,
+    "bool": lambda v: b"\x01" if v else b"\x00",
+}
+
+
+def _encode_binary(rows: Iterable[Sequence[Any]], types: Sequence[str]) -> Iterator[bytes]:
+    encoders = [_BINARY_ENCODERS[t] for t in types]
+    row_header = struct.pack("!h", len(types))
+    yield _BINARY_HEADER
+    for row in rows:
+        parts = [row_header]
+        for v, enc in zip(row, encoders):
+            if v is None:
+                parts.append(_NULL_FIELD)
+            else:
+                data = enc(v)
+                parts.append(struct.pack("!i", len(data)))
+                parts.append(data)
+        yield b"".join(parts)
+    yield _BINARY_TRAILER
+
+
+class _ChunkReader:
+    """File-like view over an iterator of byte chunks (what copy_expert reads from)."""
+
+    def __init__(self, chunks: Iterator[bytes]):
+        self._chunks = chunks
+        self._buf = bytearray()
+        self.bytes_read = 0
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buf) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buf += chunk
+        if size < 0 or size >= len(self._buf):
+            out, self._buf = bytes(self._buf), bytearray()
+        else:
+            out = bytes(self._buf[:size])
+            del self._buf[:size]
+        self.bytes_read += len(out)
+        return out
+
+
+def copy_rows(cur, table: str, columns: Sequence[str], types: Sequence[str],
+              rows: Iterable[Sequence[Any]], fmt: str = "text",
+              buffer_size: int = 1 << 16) -> int:
+    """
+    COPY `rows` into `table`; returns the number of bytes sent.
+    `types` gives the Postgres type of each column (see module header).
+    """
+    if fmt not in COPY_FORMATS:
+        raise ValueError(f"Unsupported COPY format: {fmt}")
+    chunks = _encode_binary(rows, types) if fmt == "binary" else _encode_text(rows, types)
+    reader = _ChunkReader(chunks)
+    opts = " (FORMAT binary)" if fmt == "binary" else ""
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN{opts}", reader, size=buffer_size)
+    return reader.bytes_read
@@ -4,6 +4,7 @@ from passlib.context import CryptContext
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from login_server import User, Base  # Reuse your model definition
+from token_cache import bump_epoch
 
 if len(sys.argv) != 3:
     print("Usage: python reset_password_admin.py <email> <new_password>")
@@ -28,5 +29,7 @@ if not user:
 # Update hashed password
 user.hashed_password = pwd_context.hash(new_password)
 db.commit()
+# Running servers drop their cached token verifications on their next request
+bump_epoch()
 
 print(f"Password for {email} updated successfully.")
@@ -0,0 +1,128 @@
+# token_cache.py
+# Purpose: in-process TTL/LRU cache of verified JWTs, so protected endpoints
+# do not decode the token and query users.db on every request.
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_TTL_SECONDS = float(os.getenv("TOKEN_CACHE_TTL_SECONDS", "300"))
+# Touched whenever a user changes; other processes/workers compare its mtime
+# to drop their caches (reset_password_admin.py runs outside the server).
+TOKEN_CACHE_EPOCH_FILE = os.getenv(
+    "TOKEN_CACHE_EPOCH_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".token_cache_epoch"),
+)
+EPOCH_CHECK_SECONDS = 1.0
+
+
+class TokenCache:
+    """
+    Maps a raw bearer token to the verified email (`sub`).
+    - Bounded: least recently used entries are evicted beyond `maxsize`.
+    - An entry lives for `ttl` seconds, and never past the token's own `exp`.
+    - invalidate_user() drops every cached token of one user.
+    """
+
+    def __init__(self, maxsize: int = TOKEN_CACHE_SIZE, ttl: float = TOKEN_CACHE_TTL_SECONDS,
+                 epoch_file: str = TOKEN_CACHE_EPOCH_FILE):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.epoch_file = epoch_file
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._epoch = self._read_epoch()
+        self._epoch_checked_at = time.monotonic()
+
+    def _read_epoch(self) -> float:
+        try:
+            return os.stat(self.epoch_file).st_mtime
+        except OSError:
+            return 0.0
+
+    def _check_epoch(self, now: float) -> None:
+        # Throttled: one stat() per EPOCH_CHECK_SECONDS, not one per request
+        if now - self._epoch_checked_at < EPOCH_CHECK_SECONDS:
+            return
+        self._epoch_checked_at = now
+        epoch = self._read_epoch()
+        if epoch != self._epoch:
+            self._epoch = epoch
+            self._entries.clear()
+            self.invalidations += 1
+
+    def get(self, token: str) -> Optional[str]:
+        now = time.monotonic()
+        with self._lock:
+            self._check_epoch(now)
+            entry = self._entries.get(token)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    del self._entries[token]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, token: str, email: str, exp: Optional[float] = None) -> None:
+        now = time.monotonic()
+        expires_at = now + self.ttl
+        if exp is not None:
+            # exp is wall-clock; convert the remaining lifetime to monotonic time
+            expires_at = min(expires_at, now + (exp - time.time()))
+        if expires_at <= now:
+            return
+        with self._lock:
+            self._entries[token] = (email, expires_at)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate_user(self, email: str) -> None:
+        """Drop this user's tokens here, and tell other processes to drop their caches."""
+        with self._lock:
+            for token in [t for t, (e, _) in self._entries.items() if e == email]:
+                del self._entries[token]
+            self.invalidations += 1
+        bump_epoch(self.epoch_file)
+        with self._lock:
+            self._epoch = self._read_epoch()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+def bump_epoch(epoch_file: str = TOKEN_CACHE_EPOCH_FILE) -> None:
+    """Invalidate the token caches of every process sharing `epoch_file`."""
+    with open(epoch_file, "a"):
+        pass
+    now = time.time()
+    try:
+        os.utime(epoch_file, (now, now))
+    except OSError:
+        pass
+
+
+token_cache = TokenCache()
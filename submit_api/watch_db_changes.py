@@ -1,41 +1,118 @@
 import os, time, signal
+from psycopg2 import connect
 from pymongo import MongoClient
-from metrics_reader import get_cursor, save_cursor, get_metrics_since
+from pymongo.errors import OperationFailure
+from metrics_reader import get_cursor, save_cursor, get_resume_token, save_resume_token, _to_dict
+import exporter_metrics as em
 import mongodb_to_sql as xport
+from metrics_store import METRICS_TIMESERIES, ts_to_iso
 
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://metrics-db:27017/")
 DB = os.getenv("METRICS_DB_NAME", "metricsdb")
 COL = os.getenv("METRICS_COLLECTION", "metrics")
 PROCESSOR = os.getenv("PROCESSOR_NAME", "kv_exporter")
+# A batch is flushed to Postgres after BATCH_SECONDS or BATCH_DOCS documents, whichever comes first
 BATCH_SECONDS = float(os.getenv("BATCH_SECONDS", "2.0"))
+BATCH_DOCS = int(os.getenv("BATCH_DOCS", "1000"))
+
+# Server error codes meaning the stored resume token can no longer be used
+CHANGE_STREAM_HISTORY_LOST = (280, 286)
 
 stop = False
-def _stop(*_): 
+def _stop(*_):
     global stop; stop = True
 signal.signal(signal.SIGTERM, _stop); signal.signal(signal.SIGINT, _stop)
 
+def poll():
+    # Time-series collections do not support change streams: export on a timer instead
+    while not stop:
+        try:
+            xport.export_incremental()
+        except Exception as e:
+            em.RETRIES.labels("error").inc()
+            time.sleep(1.0)
+        time.sleep(BATCH_SECONDS)
+
+def flush(docs, resume_token, read_seconds: float = 0.0) -> int:
+    """
+    Write the documents of a batch of events, then persist where the stream is.
+    The token is saved only after the Postgres commit: a crash in between
+    replays the batch, which ON CONFLICT turns into a no-op.
+    """
+    em.STAGE_SECONDS.labels("read").observe(read_seconds)
+    with connect(xport.PG_DSN) as conn, conn.cursor() as cur:
+        inserted = xport.write_docs(cur, docs)
+        with em.stage("commit"):
+            conn.commit()
+    # Keep the (timestamp, _id) watermark current for export_incremental catch-ups.
+    # Events arrive in commit order, not keyset order: with concurrent writers the
+    # last event is not necessarily the batch's highest (timestamp, _id)
+    last = max(docs, key=lambda d: (d["timestamp"], d["_id"]))
+    last_ts = ts_to_iso(last["timestamp"])
+    save_cursor(PROCESSOR, last_ts, last["_id"])
+    save_resume_token(PROCESSOR, resume_token)
+    em.watermark(PROCESSOR, last_ts)
+    return inserted
+
+def tail(col):
+    """
+    Consume insert events and export their fullDocument in batches.
+    - Resumes after the stored token; without one (first start, or history
+      lost) the stream is opened first and the backlog exported through the
+      watermark, so nothing inserted in between is missed.
+    - try_next() waits on the server (max_await_time_ms) instead of sleeping.
+      Only the calls that returned an event count as read time.
+    """
+    token = get_resume_token(PROCESSOR)
+    max_await_ms = max(100, int(min(BATCH_SECONDS, 1.0) * 1000))
+    pipeline = [{"$match": {"operationType": "insert"}}]
+    with col.watch(pipeline, resume_after=token, max_await_time_ms=max_await_ms) as stream:
+        if token is None:
+            xport.export_incremental()
+            save_resume_token(PROCESSOR, stream.resume_token)
+        pending = []
+        batch_started = time.monotonic()
+        read_seconds = 0.0
+        while not stop and stream.alive:
+            start = time.perf_counter()
+            change = stream.try_next()
+            em.CAUGHT_UP.labels(PROCESSOR).set(change is None and not pending)
+            if change is not None:
+                if not pending:
+                    batch_started = time.monotonic()
+                pending.append(_to_dict(change["fullDocument"]))
+                read_seconds += time.perf_counter() - start
+            if pending and (len(pending) >= BATCH_DOCS or time.monotonic() - batch_started >= BATCH_SECONDS):
+                flush(pending, stream.resume_token, read_seconds)
+                pending, read_seconds = [], 0.0
+        if pending:
+            flush(pending, stream.resume_token, read_seconds)
+
 def main():
-    client = MongoClient(MONGO_URI)
+    em.serve(PROCESSOR)
+    # Report the lag from the start, before the first batch
+    em.watermark(PROCESSOR, get_cursor(PROCESSOR)[0])
+    if METRICS_TIMESERIES:
+        poll()
+        return
+    xport.ensure_schema()
+    client = MongoClient(MONGO_URI, tz_aware=True)
     col = client[DB][COL]
-    # watch inserts only
-    with col.watch([{"$match": {"operationType": "insert"}}], full_document="updateLookup") as stream:
-        last_tick = time.time()
-        pending = 0
-        while not stop:
-            try:
-                if stream.try_next():
-                    pending += 1
-                now = time.time()
-                if pending and (now - last_tick >= BATCH_SECONDS):
-                    # do an incremental export (cursor persisted)
-                    inserted = xport.export_incremental()
-                    pending = 0
-                    last_tick = now
-                elif not pending:
-                    time.sleep(0.2)
-            except Exception as e:
-                # brief backoff on transient errors
+    while not stop:
+        try:
+            tail(col)
+        except OperationFailure as e:
+            if e.code in CHANGE_STREAM_HISTORY_LOST:
+                # The oplog rolled past our token: restart from the watermark
+                em.RETRIES.labels("history_lost").inc()
+                save_resume_token(PROCESSOR, None)
+            else:
+                em.RETRIES.labels("mongo_error").inc()
                 time.sleep(1.0)
+        except Exception as e:
+            # brief backoff on transient errors, then resume from the stored token
+            em.RETRIES.labels("error").inc()
+            time.sleep(1.0)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,309 @@
+# wide_sink.py
+# Purpose: "wide" Postgres sink for exported metrics, an alternative to the
+# one-row-per-key metrics_kv table (SINK_MODE=wide|both in mongodb_to_sql).
+# - public.metrics_wide holds one row per metric document: typed columns for
+#   frequently seen keys, everything else in the `extra` JSONB column.
+# - Key frequencies are counted per batch in public.metrics_key_stats. A key
+#   present in at least WIDE_PROMOTE_MIN_FRACTION of the documents (after
+#   WIDE_PROMOTE_MIN_DOCS documents) gets its own column: DOUBLE PRECISION when
+#   its values are numeric, TEXT otherwise.
+# - Columns are added online (ADD COLUMN without default, under a short
+#   lock_timeout) in their own transaction on a separate connection, before
+#   the batch is inserted, and recorded in public.metrics_wide_columns. Rows
+#   written before a promotion keep that key in `extra`; backfill_columns()
+#   moves them.
+
+import hashlib
+import json
+import os
+import re
+import sys
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from psycopg2 import errors, sql
+from psycopg2.extras import execute_values
+
+# utils/ is the repository's (in the image: /app/utils, next to this file)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from pg_ddl import run_ddl
+from utils.flatten import flatten
+
+WIDE_PROMOTE_MIN_FRACTION = float(os.getenv("WIDE_PROMOTE_MIN_FRACTION", "0.5"))
+WIDE_PROMOTE_MIN_DOCS = int(os.getenv("WIDE_PROMOTE_MIN_DOCS", "100"))
+# Keys whose values are numeric at least this often become DOUBLE PRECISION columns
+WIDE_NUMERIC_FRACTION = float(os.getenv("WIDE_NUMERIC_FRACTION", "0.99"))
+WIDE_MAX_COLUMNS = int(os.getenv("WIDE_MAX_COLUMNS", "200"))
+WIDE_LOCK_TIMEOUT = os.getenv("WIDE_LOCK_TIMEOUT", "2s")
+
+# Pseudo-key in metrics_key_stats counting all documents seen
+TOTAL_KEY = "__documents__"
+
+DDL = """
+CREATE TABLE IF NOT EXISTS public.metrics_wide (
+    source_oid TEXT PRIMARY KEY,             -- Mongo _id as string (idempotency guard)
+    publisher_email TEXT NOT NULL,
+    ts TIMESTAMPTZ NOT NULL,
+    extra JSONB NULL                         -- keys without their own column
+);
+CREATE INDEX IF NOT EXISTS ix_metrics_wide_email_ts ON public.metrics_wide (publisher_email, ts);
+CREATE TABLE IF NOT EXISTS public.metrics_wide_columns (
+    key TEXT PRIMARY KEY,                    -- flattened key, e.g. labels.node
+    column_name TEXT NOT NULL UNIQUE,
+    pg_type TEXT NOT NULL,
+    added_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE TABLE IF NOT EXISTS public.metrics_key_stats (
+    key TEXT PRIMARY KEY,
+    docs BIGINT NOT NULL DEFAULT 0,          -- documents containing the key
+    numeric_docs BIGINT NOT NULL DEFAULT 0,  -- ... with a numeric value
+    last_seen TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+"""
+
+_RESERVED = {"source_oid", "publisher_email", "ts", "extra"}
+
+
+def ensure_schema(cur) -> None:
+    cur.execute(DDL)
+
+
+def column_name(key: str, taken: Iterable[str] = ()) -> str:
+    """Postgres-safe column name for a flattened key: labels.node -> labels_node."""
+    name = re.sub(r"[^a-z0-9_]+", "_", key.lower()).strip("_") or "key"
+    if name[0].isdigit() or name in _RESERVED:
+        name = f"k_{name}"
+    if len(name) > 63 or name in taken:
+        # Too long, or another key already sanitized to this name
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:8]
+        name = f"{name[:54]}_{digest}"
+    return name
+
+
+def load_columns(cur) -> Dict[str, Tuple[str, str]]:
+    """key -> (column_name, pg_type) of the promoted keys."""
+    cur.execute("SELECT key, column_name, pg_type FROM public.metrics_wide_columns ORDER BY column_name")
+    return {key: (col, pg_type) for key, col, pg_type in cur.fetchall()}
+
+
+def _is_number(v: Any) -> bool:
+    return isinstance(v, (int, float)) and not isinstance(v, bool)
+
+
+def _typed(v: Any, pg_type: str) -> Tuple[bool, Any]:
+    """(fits, value) for a promoted column; values that do not fit stay in `extra`."""
+    if pg_type == "double precision":
+        return (True, float(v)) if _is_number(v) else (False, None)
+    if isinstance(v, (str, bool)):
+        return True, str(v)
+    return False, None
+
+
+def rows_from_docs(flat_docs: Iterable[Tuple[Dict[str, Any], Dict[str, Any]]],
+                   columns: Dict[str, Tuple[str, str]]) -> List[Tuple]:
+    """
+    One row per (document, flattened body): (source_oid, publisher_email, ts,
+    extra, *promoted values).
+    """
+    position = {k: i for i, k in enumerate(columns)}
+    rows = []
+    for m, flat in flat_docs:
+        values: List[Any] = [None] * len(position)
+        extra: Dict[str, Any] = {}
+        for k, v in flat.items():
+            if k in columns:
+                fits, typed = _typed(v, columns[k][1])
+                if fits:
+                    values[position[k]] = typed
+                    continue
+            extra[k] = v
+        rows.append((
+            m["_id"], m["publisher_email"], m["timestamp"],
+            json.dumps(extra, separators=(",", ":"), default=str) if extra else None,
+            *values,
+        ))
+    return rows
+
+
+def count_keys(flats: Iterable[Dict[str, Any]]) -> Tuple[Counter, Counter]:
+    """(documents per key, documents with a numeric value per key) of flattened bodies."""
+    stats: Counter = Counter()
+    numeric: Counter = Counter()
+    for flat in flats:
+        stats[TOTAL_KEY] += 1
+        for k, v in flat.items():
+            stats[k] += 1
+            if _is_number(v):
+                numeric[k] += 1
+    return stats, numeric
+
+
+def _update_stats(cur, stats: Counter, numeric: Counter) -> None:
+    execute_values(
+        cur,
+        """
+        INSERT INTO public.metrics_key_stats AS s (key, docs, numeric_docs)
+        VALUES %s
+        ON CONFLICT (key) DO UPDATE
+            SET docs = s.docs + EXCLUDED.docs,
+                numeric_docs = s.numeric_docs + EXCLUDED.numeric_docs,
+                last_seen = now()
+        """,
+        # Sorted: concurrent writers lock the stats rows in the same order
+        sorted((k, n, numeric[k]) for k, n in stats.items()),
+    )
+
+
+def promotion_candidates(cur, columns: Dict[str, Tuple[str, str]]) -> List[Tuple[str, int, int]]:
+    """(key, docs, numeric_docs) of frequent keys without a column yet, read-only."""
+    room = WIDE_MAX_COLUMNS - len(columns)
+    if room <= 0:
+        return []
+    cur.execute("SELECT docs FROM public.metrics_key_stats WHERE key = %s", (TOTAL_KEY,))
+    row = cur.fetchone()
+    total = row[0] if row else 0
+    if total < WIDE_PROMOTE_MIN_DOCS:
+        return []
+    cur.execute(
+        """
+        SELECT s.key, s.docs, s.numeric_docs FROM public.metrics_key_stats s
+        LEFT JOIN public.metrics_wide_columns c ON c.key = s.key
+        WHERE c.key IS NULL AND s.key <> %s AND s.docs >= %s
+        ORDER BY s.docs DESC, s.key
+        LIMIT %s
+        """,
+        (TOTAL_KEY, total * WIDE_PROMOTE_MIN_FRACTION, room),
+    )
+    return cur.fetchall()
+
+
+def promote_columns(cur, columns: Dict[str, Tuple[str, str]]) -> List[str]:
+    """
+    Add columns for keys that became frequent; returns the promoted keys.
+    ADD COLUMN holds an ACCESS EXCLUSIVE lock on metrics_wide until commit: run
+    this in a short transaction of its own (see write_docs).
+    """
+    candidates = promotion_candidates(cur, columns)
+    taken = {col for col, _ in columns.values()}
+    promoted = []
+    for key, docs, numeric_docs in candidates:
+        pg_type = "double precision" if numeric_docs >= docs * WIDE_NUMERIC_FRACTION else "text"
+        col = column_name(key, taken)
+        cur.execute("SAVEPOINT wide_promote")
+        try:
+            # ADD COLUMN without a default only touches the catalog, but still needs
+            # a brief exclusive lock: give up rather than queue behind long readers
+            cur.execute("SET LOCAL lock_timeout = %s", (WIDE_LOCK_TIMEOUT,))
+            cur.execute(sql.SQL("ALTER TABLE public.metrics_wide ADD COLUMN IF NOT EXISTS {} {}").format(
+                sql.Identifier(col), sql.SQL(pg_type)))
+            cur.execute(
+                "INSERT INTO public.metrics_wide_columns (key, column_name, pg_type) VALUES (%s, %s, %s) "
+                "ON CONFLICT (key) DO NOTHING",
+                (key, col, pg_type),
+            )
+            cur.execute("RELEASE SAVEPOINT wide_promote")
+        except (errors.LockNotAvailable, errors.DeadlockDetected, errors.UniqueViolation):
+            cur.execute("ROLLBACK TO SAVEPOINT wide_promote")
+            continue  # retried with the next batch
+        taken.add(col)
+        promoted.append(key)
+    cur.execute("SET LOCAL lock_timeout = DEFAULT")
+    return promoted
+
+
+def write_docs(cur, docs: Iterable[Dict[str, Any]]) -> int:
+    """
+    Write metric docs (already in metrics_reader._to_dict form) to metrics_wide
+    and update key statistics. Keys that became frequent in earlier batches are
+    promoted first. Only documents actually inserted are counted in the
+    statistics: replays and re-read windows are skipped by ON CONFLICT.
+    Returns the number of documents written.
+    """
+    columns = load_columns(cur)
+    if promotion_candidates(cur, columns):
+        # Promote before this transaction writes to metrics_wide, on another connection:
+        # the ALTER's lock is then released at once instead of lasting until the chunk commits
+        run_ddl(lambda ddl_cur: promote_columns(ddl_cur, load_columns(ddl_cur)))
+        columns = load_columns(cur)
+    flat_docs = [(m, flatten(m.get("body", {}))) for m in docs]
+    rows = rows_from_docs(flat_docs, columns)
+    if not rows:
+        return 0
+    names = ["source_oid", "publisher_email", "ts", "extra"] + [col for col, _ in columns.values()]
+    inserted = {oid for (oid,) in execute_values(
+        cur,
+        sql.SQL("INSERT INTO public.metrics_wide ({}) VALUES %s ON CONFLICT (source_oid) DO NOTHING "
+                "RETURNING source_oid").format(
+            sql.SQL(", ").join(map(sql.Identifier, names))).as_string(cur),
+        rows,
+        template="(%s, %s, %s, %s::jsonb" + ", %s" * len(columns) + ")",
+        page_size=1000,
+        fetch=True,
+    )}
+    new = []
+    for m, flat in flat_docs:
+        if m["_id"] in inserted:
+            inserted.discard(m["_id"])  # a document repeated in the batch is inserted once
+            new.append(flat)
+    if new:
+        _update_stats(cur, *count_keys(new))
+    return len(rows)
+
+
+def _backfill_terms(key: str, col: str, pg_type: str, n: int):
+    """(fits condition, SET expression) moving one key out of `extra`; `n` numbers the parameter."""
+    k = sql.Placeholder(f"k{n}")
+    typeof = sql.SQL("jsonb_typeof(extra -> {})").format(k)
+    if pg_type == "double precision":
+        fits = sql.SQL("{} = 'number'").format(typeof)
+        value = sql.SQL("(extra ->> {})::double precision").format(k)
+    else:
+        fits = sql.SQL("{} IN ('string', 'boolean')").format(typeof)
+        # Same spelling as the live path (str(True) == 'True')
+        value = sql.SQL("CASE WHEN {t} = 'boolean' THEN initcap(extra ->> {k}) ELSE extra ->> {k} END").format(t=typeof, k=k)
+    fits = sql.SQL("({} AND {} IS NULL)").format(fits, sql.Identifier(col))
+    set_col = sql.SQL("{c} = CASE WHEN {f} THEN {v} ELSE {c} END").format(c=sql.Identifier(col), f=fits, v=value)
+    return fits, set_col
+
+
+def backfill_columns(conn, keys: Optional[Iterable[str]] = None, batch_size: int = 10000) -> int:
+    """
+    Move promoted keys (default: all) out of `extra` into their columns for rows
+    written before the promotion. All keys of a row are moved by one UPDATE, in
+    batches of `batch_size` rows (one transaction each). Values that do not fit
+    the column type stay in `extra`. Returns the number of rows updated.
+    """
+    with conn.cursor() as cur:
+        columns = load_columns(cur)
+    keys = list(columns) if keys is None else list(keys)
+    unknown = [k for k in keys if k not in columns]
+    if unknown:
+        raise ValueError(f"Not promoted: {', '.join(unknown)}")
+    if not keys:
+        return 0
+    params: Dict[str, Any] = {"n": batch_size}
+    fits_any, sets, extra = [], [], sql.SQL("extra")
+    for n, key in enumerate(keys):
+        params[f"k{n}"] = key
+        fits, set_col = _backfill_terms(key, *columns[key], n)
+        fits_any.append(fits)
+        sets.append(set_col)
+        # jsonb - text is strict: remove '' (no such key) when the value stays
+        extra = sql.SQL("({} - CASE WHEN {} THEN {} ELSE '' END)").format(extra, fits, sql.Placeholder(f"k{n}"))
+    stmt = sql.SQL("""
+        UPDATE public.metrics_wide SET {sets}, extra = NULLIF({extra}, '{{}}'::jsonb)
+        WHERE source_oid IN (
+            SELECT source_oid FROM public.metrics_wide
+            WHERE extra IS NOT NULL AND ({fits_any})
+            LIMIT %(n)s
+        )
+    """).format(sets=sql.SQL(", ").join(sets), extra=extra, fits_any=sql.SQL(" OR ").join(fits_any))
+    moved = 0
+    while True:
+        with conn.cursor() as cur:
+            cur.execute(stmt, params)
+            n = cur.rowcount
+        conn.commit()
+        moved += n
+        if n < batch_size:
+            return moved
@@ -0,0 +1,82 @@
+# utils/flatten.py
+# Purpose: one flattener for nested metric payloads, shared by the exporter
+# (submit_api/mongodb_to_sql.py), namespace_mapper.py and
+# parsers/structured_parser.py.
+# - Iterative (an explicit stack of iterators): no recursion limit on deep
+#   documents and no intermediate dicts; every value is written once into `out`.
+# - Key prefixes are built once per container, not once per leaf and level.
+from typing import Any, Dict, Iterable, Optional
+
+
+def _children(obj: Any):
+    return obj.items() if type(obj) is dict or isinstance(obj, dict) else enumerate(obj)
+
+
+def flatten(
+    obj: Any,
+    sep: str = ".",
+    lists: bool = True,
+    max_depth: Optional[int] = None,
+    include: Optional[Iterable[str]] = None,
+    out: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """
+    Flatten nested dicts (and lists) into one level of joined keys.
+        {"labels": {"node": "n1"}, "arr": [10, 20]} ->
+        {"labels.node": "n1", "arr.0": 10, "arr.1": 20}
+    - lists: expand lists with their indices as keys (False keeps them as values).
+    - max_depth: expand at most this many levels; deeper containers are kept as values.
+    - include: only these flattened keys are returned. Subtrees that cannot
+      contain one of them are not walked; a listed container is kept whole.
+    - Empty dicts/lists produce no key. A scalar `obj` is returned as {"": obj}.
+    Later duplicates of a key (e.g. "a.b" next to {"a": {"b": ...}}) win.
+    """
+    if out is None:
+        out = {}
+    nested = (dict, list) if lists else dict
+    if not isinstance(obj, nested):
+        out[""] = obj
+        return out
+
+    wanted = walk = None
+    if include is not None:
+        wanted = set(include)
+        # Every proper prefix of a wanted key names a container on its path
+        walk = set()
+        for key in wanted:
+            parts = key.split(sep)
+            for i in range(1, len(parts)):
+                walk.add(sep.join(parts[:i]))
+
+    stack = [(iter(_children(obj)), "", 1)]
+    push, pop = stack.append, stack.pop
+    if wanted is None and max_depth is None:
+        # Common case, kept free of per-key option checks
+        while stack:
+            items, prefix, depth = stack[-1]
+            for k, v in items:
+                if isinstance(v, nested):
+                    if v:
+                        push((iter(_children(v)), f"{prefix}{k}{sep}", depth))
+                        break
+                else:
+                    out[f"{prefix}{k}"] = v
+            else:
+                pop()
+        return out
+
+    while stack:
+        items, prefix, depth = stack[-1]
+        for k, v in items:
+            key = f"{prefix}{k}"
+            if isinstance(v, nested) and (max_depth is None or depth < max_depth):
+                if wanted is not None and key in wanted:
+                    out[key] = v
+                elif v and (walk is None or key in walk):
+                    push((iter(_children(v)), key + sep, depth + 1))
+                    break
+            elif wanted is None or key in wanted:
+                out[key] = v
+        else:
+            pop()
+    return out
@@ -1,37 +1,123 @@
 # utils/mapping_sync.py
+# Purpose: add sources to metric_mapping.json from the Streamlit uploader and
+# the ingestion workers, possibly several processes at once.
+# - Updates are batched: one read and one write for any number of keys.
+# - Writers hold an exclusive lock on "<file>.lock" for the read-modify-write,
+#   so concurrent updates are never lost.
+# - The new content goes to a temp file in the same directory and replaces the
+#   mapping with os.replace(): readers see the old or the new file, never a
+#   truncated one, even after a crash.
+# - A batch that adds nothing new does not rewrite the file.
 import os
 import json
+import tempfile
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from project_config.metric_mapping import MAPPING_FILE, invalidate_path
+
+# The file project_config.metric_mapping.registry (and so the extractors) reads
+MAPPING_PATH = MAPPING_FILE
+
+
+class MappingStore:
+    """A mapping file ({unified_key: {"tags": [...], "sources": [...]}}) updated under a file lock with atomic writes."""
+
+    def __init__(self, path):
+        self.path = path
+
+    @contextmanager
+    def _locked(self):
+        with open(self.path + ".lock", "a+b") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            else:
+                lock.seek(0)
+                msvcrt.locking(lock.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+                else:
+                    lock.seek(0)
+                    msvcrt.locking(lock.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def load(self) -> dict:
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write(self, mapping: dict) -> None:
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".metric_mapping.", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(mapping, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            # mkstemp creates the file 0600: keep the mapping's permissions
+            mode = os.stat(self.path).st_mode if os.path.exists(self.path) else 0o644
+            os.chmod(tmp_path, mode & 0o777)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def add_sources(self, updates) -> list:
+        """
+        Adds (unified_key, source_key, tags) entries in one locked read-modify-write.
+        Returns the unified keys that changed; the file is only rewritten if any did.
+        """
+        with self._locked():
+            mapping = self.load()
+            changed = []
+            for unified_key, source_key, tags in updates:
+                entry = mapping.get(unified_key)
+                if entry is None:
+                    entry = mapping[unified_key] = {"tags": [], "sources": []}
+                    dirty = True
+                else:
+                    dirty = False
+                if source_key not in entry["sources"]:
+                    entry["sources"].append(source_key)
+                    dirty = True
+                for tag in tags or []:
+                    if tag not in entry["tags"]:
+                        entry["tags"].append(tag)
+                        dirty = True
+                if dirty and unified_key not in changed:
+                    changed.append(unified_key)
+            if changed:
+                self._write(mapping)
+        if changed:
+            invalidate_path(self.path)
+        return changed
+
+
+store = MappingStore(MAPPING_PATH)
+
+
+def sync_metric_mappings(updates) -> list:
+    """
+    Adds or updates the mapping file with many (unified_key, source_key, tags)
+    entries at once.
+    """
+    changed = store.add_sources(updates)
+    if changed:
+        print(f"🔄 Synced metric_mapping.json with {len(changed)} keys: {', '.join(changed)}")
+    return changed
 
-MAPPING_PATH = os.path.join(os.path.dirname(__file__), "../metric_mapping.json")
 
 def sync_metric_mapping(unified_key: str, source_key: str, tags: list = None):
     """
     Adds or updates the mapping file with the new source under the unified key.
     """
-    if tags is None:
-        tags = []
-
-    # Load current mapping
-    if os.path.exists(MAPPING_PATH):
-        with open(MAPPING_PATH, "r", encoding="utf-8") as f:
-            mapping = json.load(f)
-    else:
-        mapping = {}
-
-    # Add or update the unified key
-    if unified_key not in mapping:
-        mapping[unified_key] = {
-            "tags": tags,
-            "sources": [source_key]
-        }
-    else:
-        if source_key not in mapping[unified_key]["sources"]:
-            mapping[unified_key]["sources"].append(source_key)
-        for tag in tags:
-            if tag not in mapping[unified_key]["tags"]:
-                mapping[unified_key]["tags"].append(tag)
-
-    # Write back
-    with open(MAPPING_PATH, "w", encoding="utf-8") as f:
-        json.dump(mapping, f, indent=2)
-    print(f"🔄 Synced metric_mapping.json with key: {unified_key}")
+    if store.add_sources([(unified_key, source_key, tags)]):
+        print(f"🔄 Synced metric_mapping.json with key: {unified_key}")